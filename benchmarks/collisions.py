@@ -0,0 +1,68 @@
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import pygame
+from codijoc import AssetCache, Enemy, ProjectileSystem, SpatialHash, WIDTH, HEIGHT
+
+# Stress test: player bullets against enemies, brute force versus the spatial hash
+
+
+def build(enemy_count, bullet_count, world_width):
+    random.seed(1)
+    assets = AssetCache()
+    enemies = pygame.sprite.Group(Enemy(random.randrange(world_width), random.randrange(HEIGHT), assets)
+                                  for _ in range(enemy_count))
+    projectiles = ProjectileSystem(assets, capacity=bullet_count)
+    for _ in range(bullet_count):
+        projectiles.spawn(random.randrange(world_width), random.randrange(HEIGHT), 1, ProjectileSystem.PLAYER)
+    return enemies, projectiles
+
+
+def brute_force(enemies, projectiles):
+    rect = pygame.Rect(0, 0, projectiles.width, projectiles.height)
+    targets = [enemy.rect for enemy in enemies]
+    hits = 0
+    for i in range(projectiles.count):
+        rect.x = int(projectiles.x[i])
+        rect.y = int(projectiles.y[i])
+        hits += len(rect.collidelistall(targets))
+    return hits
+
+
+def hashed(enemies, projectiles):
+    index = SpatialHash()
+    index.rebuild(enemies)
+    rect = pygame.Rect(0, 0, projectiles.width, projectiles.height)
+    hits = 0
+    for i in range(projectiles.count):
+        rect.x = int(projectiles.x[i])
+        rect.y = int(projectiles.y[i])
+        hits += len(index.query(rect))
+    return hits
+
+
+def main():
+    pygame.display.set_mode((WIDTH, HEIGHT))
+    print(f"{'enemies':>8} {'bullets':>8} {'brute ms':>10} {'hash ms':>10} {'hits':>6}")
+    for enemy_count, bullet_count in [(100, 1000), (300, 3000), (500, 5000)]:
+        enemies, projectiles = build(enemy_count, bullet_count, 30000)
+        start = time.perf_counter()
+        brute_hits = brute_force(enemies, projectiles)
+        brute_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        hash_hits = hashed(enemies, projectiles)
+        hash_ms = (time.perf_counter() - start) * 1000
+        assert brute_hits == hash_hits
+        print(f"{enemy_count:>8} {bullet_count:>8} {brute_ms:>10.2f} {hash_ms:>10.2f} {hash_hits:>6}")
+
+
+if __name__ == "__main__":
+    main()
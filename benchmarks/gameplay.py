@@ -0,0 +1,140 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from codijoc import Controls, Enemy, Game, Goal, Platform, ProjectileSystem, HEIGHT, WIDTH
+
+# Times every phase of a level tick on synthetic worlds and compares the result with a saved baseline.
+#
+#   python benchmarks/gameplay.py              run and compare with benchmarks/baseline.json
+#   python benchmarks/gameplay.py --save       run and overwrite the baseline
+
+BASELINE = os.path.join(ROOT, "benchmarks", "baseline.json")
+PHASES = ["input", "physics", "ai", "collisions", "render"]
+SCENARIOS = [
+    {"name": "enemies_10", "enemies": 10, "bullets": 100, "world_width": 3000},
+    {"name": "enemies_100", "enemies": 100, "bullets": 100, "world_width": 3000},
+    {"name": "enemies_1000", "enemies": 1000, "bullets": 100, "world_width": 30000},
+    {"name": "enemies_5000", "enemies": 5000, "bullets": 100, "world_width": 30000},
+    {"name": "bullets_5000", "enemies": 100, "bullets": 5000, "world_width": 3000},
+    {"name": "world_30k", "enemies": 100, "bullets": 100, "world_width": 30000},
+]
+
+
+def build_world(game, enemies, bullets, world_width):
+    # A level with one platform every 200 px and enemies spread evenly across them
+    random.seed(1)
+    game.state = "playing"
+    game.lives = 3
+    game.reset_game()
+    game.platforms.empty()
+    game.enemies.clear()
+    game.goals.empty()
+    game.camera.reset(world_width)
+    game.projectiles = ProjectileSystem(game.assets, capacity=bullets * 2 + enemies)
+    platforms = [Platform(x, random.randrange(150, 450), 150, 20) for x in range(0, world_width - 200, 200)]
+    game.platforms.add(platforms)
+    game.platform_index.rebuild(game.platforms)
+    game.static_layer.bake(game.platforms)
+    for i in range(enemies):
+        platform = platforms[i * len(platforms) // enemies]
+        enemy = Enemy(platform.rect.x + random.randrange(0, 110), platform.rect.y - 40, game.assets)
+        game.enemies.add(enemy)
+    goal = Goal(world_width - 200, 450)
+    game.goals.add(goal)
+    # Keep the player alive for the whole run so every tick does the same amount of work
+    game.player.take_damage = lambda: False
+
+
+def refill_bullets(game, bullets):
+    projectiles = game.projectiles
+    view = game.camera.view
+    while projectiles.count < bullets:
+        owner = ProjectileSystem.PLAYER if projectiles.count % 2 else ProjectileSystem.ENEMY
+        projectiles.spawn(random.randrange(view.left, view.right), random.randrange(HEIGHT),
+                          random.choice([-1, 1]), owner)
+
+
+def run_scenario(game, scenario, ticks):
+    build_world(game, scenario["enemies"], scenario["bullets"], scenario["world_width"])
+    totals = dict.fromkeys(PHASES, 0)
+    controls = Controls(dx=1, shoot=True)
+
+    def take_input():
+        # Reading the keyboard does nothing under the dummy driver; applying the controls moves the
+        # player, spawns shots and schedules the reload, as step_level times it
+        game.read_controls()
+        game.apply_controls(controls)
+
+    phases = [
+        ("input", take_input),
+        ("physics", game.update_physics),
+        ("ai", game.update_enemies),
+        ("collisions", game.resolve_collisions),
+        ("render", game.draw_level),
+    ]
+    for tick in range(ticks):
+        refill_bullets(game, scenario["bullets"])
+        controls.jump = tick % 45 == 0
+        if game.player.rect.x > scenario["world_width"] - WIDTH:
+            game.player.rect.x = 100
+            game.camera.reset(scenario["world_width"])
+        for name, phase in phases:
+            start = time.perf_counter_ns()
+            phase()
+            totals[name] += time.perf_counter_ns() - start
+        game.state = "playing"
+    return {name: totals[name] / ticks / 1000 for name in PHASES}
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, phases in results.items():
+        for phase, value in phases.items():
+            previous = baseline.get(name, {}).get(phase)
+            if previous and value > previous * (1 + tolerance):
+                regressions.append(f"{name}/{phase}: {previous:.1f} us -> {value:.1f} us")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gameplay loop benchmarks")
+    parser.add_argument("--ticks", type=int, default=300)
+    parser.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before failing")
+    args = parser.parse_args()
+
+    game = Game(headless=True)
+    results = {}
+    print(f"{'scenario':<14}" + "".join(f"{phase + ' us':>14}" for phase in PHASES))
+    for scenario in SCENARIOS:
+        results[scenario["name"]] = run_scenario(game, scenario, args.ticks)
+        print(f"{scenario['name']:<14}" + "".join(f"{results[scenario['name']][phase]:>14.1f}"
+                                                   for phase in PHASES))
+
+    if args.save:
+        with open(BASELINE, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {BASELINE}")
+    elif os.path.exists(BASELINE):
+        with open(BASELINE) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("No regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
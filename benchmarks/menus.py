@@ -0,0 +1,93 @@
+import os
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import pygame
+from codijoc import AssetCache, LevelSelect, Menu, TextCache, HEIGHT, WIDTH
+
+# Counts the draw calls a menu frame issues and how long it takes, with the mouse away from and
+# over a button. "redraw" is the baseline: every frame draws the background, title and buttons
+# again and renders the button texts anew, as the menus did before they were baked.
+
+
+class CountingSurface(pygame.Surface):
+    calls = 0
+
+    def blit(self, *args, **kwargs):
+        CountingSurface.calls += 1
+        return super().blit(*args, **kwargs)
+
+    def blits(self, blit_sequence, *args, **kwargs):
+        blit_sequence = list(blit_sequence)
+        CountingSurface.calls += len(blit_sequence)
+        return super().blits(blit_sequence, *args, **kwargs)
+
+    def fill(self, *args, **kwargs):
+        CountingSurface.calls += 1
+        return super().fill(*args, **kwargs)
+
+
+def count_draw_module():
+    for name in ["rect", "line", "circle", "ellipse", "polygon"]:
+        original = getattr(pygame.draw, name)
+
+        def counted(*args, _original=original, **kwargs):
+            CountingSurface.calls += 1
+            return _original(*args, **kwargs)
+
+        setattr(pygame.draw, name, counted)
+
+
+class UncachedText:
+    # Stands in for TextCache so the baseline renders its text every frame
+    def render(self, font, text, antialias, color):
+        return font.render(text, antialias, color)
+
+
+def redraw(menu):
+    menu.screen.blit(menu.background, (0, 0))
+    menu.draw_title(menu.screen)
+    hovered = menu.hovered_button()
+    for i, button in enumerate(menu.buttons):
+        menu.draw_button(menu.screen, button, i == hovered, (0, 0))
+
+
+def measure(draw, mouse_pos, frames=500):
+    pygame.mouse.get_pos = lambda: mouse_pos
+    CountingSurface.calls = 0
+    start = time.perf_counter()
+    for _ in range(frames):
+        draw()
+    elapsed = time.perf_counter() - start
+    return CountingSurface.calls / frames, elapsed / frames * 1e6
+
+
+def main():
+    pygame.display.set_mode((WIDTH, HEIGHT))
+    count_draw_module()
+    screen = CountingSurface((WIDTH, HEIGHT))
+    font = pygame.font.Font(None, 80)
+    small_font = pygame.font.Font(None, 40)
+    assets = AssetCache()
+    text_cache = TextCache()
+    screens = [
+        ("menu", Menu(screen, font, small_font, assets, text_cache)),
+        ("levels", LevelSelect(screen, font, small_font, assets, text_cache)),
+    ]
+    print(f"{'screen':<8}{'mouse':<8}{'path':<8}{'calls/frame':>12}{'us/frame':>10}")
+    for name, menu in screens:
+        for label, mouse_pos in [("idle", (0, 0)), ("hover", menu.buttons[0]["rect"].center)]:
+            for path, draw in [("redraw", lambda: redraw(menu)), ("baked", menu.draw)]:
+                menu.text_cache = UncachedText() if path == "redraw" else text_cache
+                calls, micros = measure(draw, mouse_pos)
+                print(f"{name:<8}{label:<8}{path:<8}{calls:>12.0f}{micros:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
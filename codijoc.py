@@ -2,11 +2,41 @@ import pygame
 import sys
 import random
 import os
+import time
+import argparse
+import csv
+import atexit
+import logging
+import logging.handlers
+import queue
+import json
+import struct
+import hashlib
+import io
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pygame.locals import *
 
+try:
+    import numpy as np  # Optional: vectorizes EnemySystem
+except ImportError:
+    np = None
+
+asset_log = logging.getLogger("shuriken.assets")
+audio_log = logging.getLogger("shuriken.audio")
+level_log = logging.getLogger("shuriken.level")
+context_log = logging.getLogger("shuriken.context")
+replay_log = logging.getLogger("shuriken.replay")
+profile_log = logging.getLogger("shuriken.profile")
+
 # Inicialización
 pygame.init()
-pygame.mixer.init()  # Initialize the mixer for audio
+try:
+    pygame.mixer.init()  # Initialize the mixer for audio
+except pygame.error as e:
+    audio_log.warning("Couldn't initialize audio. Error: %s", e)
 
 # Constantes
 WIDTH = 800
@@ -14,9 +44,14 @@ HEIGHT = 600
 GRAVITY = 0.8
 PLAYER_SPEED = 5
 JUMP_FORCE = -15
-FPS = 60
+FPS = 60  # Simulation ticks per second; every speed and timer above counts in ticks
+TICK_MS = 1000 / FPS
+MAX_FPS = 144  # Render cap while interpolating; without interpolation gameplay renders at FPS
+MAX_FRAME_MS = 250  # Longer stalls (dragging the window, a breakpoint) are dropped, not replayed
 BULLET_SPEED = 10
 ENEMY_MOVE_SPEED = 2
+IDLE_WAIT_MS = 500  # Longest a static screen sleeps before re-checking the music
+ACTIVE_MARGIN = 200  # Entities further than this outside the screen sleep
 WORLD_WIDTH = 3000
 GROUND_LEVEL = 560
 
@@ -39,19 +74,836 @@ GLOW_YELLOW = (255, 255, 0, 128)  # Semi-transparent yellow for glow
 DARK_PURPLE = (50, 0, 100)  # For gradient sky
 RED_ORANGE = (200, 50, 50)  # For gradient sky
 DESERT_RED = (150, 50, 50)  # For desert ground
+MAGENTA = (255, 0, 255)  # Colour key of pre-rendered surfaces with holes (platform tiles, shield)
+
+# Files decoded in the background while the loading screen is up. The game waits for the startup
+# ones before showing the menu; the gameplay ones keep loading while the player is in the menus.
+STARTUP_ASSETS = ["naranja.png", "desert.png", "vida1.png", "gameover.png", "creditsns.png", "win.png",
+                  "balaninja.png", "disparo.mp3"]
+GAMEPLAY_ASSETS = ["ninja.png", "ninjap1.png", "ninjap2.png", "sherif.png", "menutienda.png"]
+MUSIC = {"menu": "musicamenu.mp3", "context": "teclado.mp3", "playing": "musicaplay.mp3"}
+SOUNDS = {"shoot": ("disparo.mp3", 0.5)}
+PLAYER_ANIMATIONS = {"run": (("ninjap1.png", "ninjap2.png"), 8)}  # Frames and ticks per frame
+# Sprites tools/build_assets.py packs, pre-scaled, into the atlas the game loads at startup
+ATLAS_INDEX = os.path.join("assets", "build", "atlas.json")
+ATLAS_IMAGES = [("sherif.png", (35, 35)), ("balaninja.png", (10, 5)), ("vida1.png", (32, 32))]
+ATLAS_ANIMATIONS = [(("ninja.png",), (35, 35))] + [(names, (35, 35)) for names, _ in PLAYER_ANIMATIONS.values()]
+
+
+class AssetCache:
+    # Loads each image once and hands out the same converted, pre-scaled surface. Variants packed
+    # into the atlas are handed out as pieces of it, already scaled, cropped and flipped.
+    def __init__(self):
+        self.surfaces = {}
+        self.pending = {}
+        self.timings = {}
+        self.atlas_sprites = {}
+        self.atlas_bounds = {}
+        self.atlas_sources = set()
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+
+    def load_atlas(self, path=ATLAS_INDEX):
+        # Any problem with the atlas means loading from the files; one sprite whose source file
+        # changed since the build is left out and loads from its file
+        try:
+            self.read_atlas(path)
+        except FileNotFoundError:
+            asset_log.info("No asset atlas at %s, loading sprites from their files", path)
+        except (OSError, ValueError, KeyError, TypeError, pygame.error) as e:
+            asset_log.warning("Couldn't use the asset atlas %s, loading sprites from their files. Error: %r",
+                              path, e)
+        else:
+            return True
+        self.atlas_sprites = {}
+        self.atlas_bounds = {}
+        self.atlas_sources = set()
+        return False
+
+    def read_atlas(self, path):
+        with open(path) as f:
+            index = json.load(f)
+        with open(os.path.join(os.path.dirname(path), index["atlas"]), "rb") as f:
+            data = f.read()
+        if hashlib.sha256(data).hexdigest() != index["sha256"]:
+            raise ValueError(f"{index['atlas']} doesn't match its index")
+        atlas = pygame.image.load(io.BytesIO(data), index["atlas"]).convert_alpha()
+        for name, built in index["sources"].items():
+            # A source counts as changed when its size or modification time differ from the build's,
+            # which costs a stat instead of reading and hashing every file
+            try:
+                stat = os.stat(os.path.join("assets", name))
+                current = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+            except FileNotFoundError:
+                current = None
+            if current != {"size": built["size"], "mtime_ns": built["mtime_ns"]}:
+                asset_log.warning("assets/%s changed since the atlas was built, loading it from its file", name)
+                continue
+            self.atlas_sources.add(name)
+            if name in index["bounds"]:
+                self.atlas_bounds[name] = pygame.Rect(index["bounds"][name])
+        for sprite in index["sprites"]:
+            if sprite["name"] in self.atlas_sources:
+                key = (sprite["name"], tuple(sprite["size"]), True, sprite["flip_x"],
+                       tuple(sprite["crop"]) if sprite["crop"] else None)
+                self.atlas_sprites[key] = atlas.subsurface(sprite["rect"])
+        self.bytes += atlas.get_pitch() * atlas.get_height()
+        asset_log.info("Loaded %d sprites from %s", len(self.atlas_sprites), index["atlas"])
+
+    def image(self, name, size=None, alpha=True, flip_x=False, crop=None):
+        key = (name, size, alpha, flip_x, crop)
+        if key in self.surfaces:
+            self.hits += 1
+            surface = self.surfaces[key]
+            if surface is None:
+                raise pygame.error(f"Couldn't load assets/{name}")
+            return surface
+        self.misses += 1
+        if key in self.atlas_sprites:
+            surface = self.surfaces[key] = self.atlas_sprites[key]
+            return surface
+        try:
+            if (size, flip_x, crop) == (None, False, None):
+                surface = self.take(name)
+                surface = surface.convert_alpha() if alpha else surface.convert()
+            else:
+                # Variants are built from the file's converted surface, so each file is decoded once
+                surface = self.image(name, alpha=alpha)
+        except (pygame.error, FileNotFoundError) as e:
+            self.surfaces[key] = None
+            raise pygame.error(str(e))
+        if crop:
+            surface = surface.subsurface(crop)
+        if size and surface.get_size() != size:
+            surface = pygame.transform.scale(surface, size)
+        if flip_x:
+            surface = pygame.transform.flip(surface, True, False)
+        if surface is self.surfaces.get((name, None, alpha, False, None)):
+            self.surfaces[key] = surface  # Already the size asked for, the same pixels under two keys
+        else:
+            self.store(key, surface)
+        return surface
+
+    def animation(self, names, size, ticks_per_frame=1):
+        # Every frame is cropped to the box that bounds the drawn pixels of all of them, so they stay
+        # aligned, then scaled and flipped once. The scale keeps the art's proportions and the frame
+        # is padded out to size, standing on its bottom edge. Sprites sharing the same frames share
+        # one Animation.
+        key = ("animation", names, size, ticks_per_frame)
+        if key in self.surfaces:
+            self.hits += 1
+            return self.surfaces[key]
+        self.misses += 1
+        bounds = [self.bounds(name) for name in names]
+        crop = bounds[0].unionall(bounds[1:])
+        scale = min(size[0] / crop.width, size[1] / crop.height)
+        fitted = (round(crop.width * scale), round(crop.height * scale))
+        crop = tuple(crop)
+        animation = Animation([self.fit(self.image(name, fitted, crop=crop), size) for name in names],
+                              [self.fit(self.image(name, fitted, flip_x=True, crop=crop), size) for name in names],
+                              ticks_per_frame)
+        self.surfaces[key] = animation
+        return animation
+
+    @staticmethod
+    def fit(surface, size):
+        # Centred horizontally, on the bottom edge; adding onto transparent black copies the pixels
+        # alpha included, where a normal blit would blend them
+        width, height = surface.get_size()
+        if (width, height) == size:
+            return surface
+        padded = pygame.Surface(size, pygame.SRCALPHA)
+        padded.blit(surface, ((size[0] - width) // 2, size[1] - height), special_flags=BLEND_RGBA_ADD)
+        return padded.convert_alpha()
+
+    def bounds(self, name):
+        # The box around the drawn pixels of a file, as it was when the atlas was built if it is in it
+        if name in self.atlas_bounds:
+            return self.atlas_bounds[name]
+        return self.image(name).get_bounding_rect()
+
+    def sound(self, name):
+        try:
+            return self.take(name)
+        except FileNotFoundError as e:
+            raise pygame.error(str(e))
+
+    def preload(self, names, workers=4):
+        # Decodes the files on a thread pool. Converting to the display format has to happen on the
+        # main thread, so image() still does that the first time each file is asked for.
+        pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="preload")
+        futures = []
+        for name in names:
+            if name in self.atlas_sources:
+                continue
+            if name not in self.pending:
+                self.pending[name] = pool.submit(self.decode, name)
+            futures.append(self.pending[name])
+        pool.shutdown(wait=False)
+        return futures
+
+    def decode(self, name):
+        start = time.perf_counter()
+        path = os.path.join("assets", name)
+        try:
+            if name.endswith((".mp3", ".ogg", ".wav")):
+                return pygame.mixer.Sound(path)
+            return pygame.image.load(path)
+        finally:
+            self.timings[name] = (time.perf_counter() - start) * 1000
+
+    def take(self, name):
+        # A preloaded file is handed out once, image() keeps what it converts from it
+        future = self.pending.pop(name, None)
+        if future is not None:
+            return future.result()
+        return self.decode(name)
+
+    def solid(self, size, color):
+        key = ("solid", size, color)
+        if key in self.surfaces:
+            self.hits += 1
+            return self.surfaces[key]
+        self.misses += 1
+        surface = pygame.Surface(size)
+        surface.fill(color)
+        self.store(key, surface)
+        return surface
+
+    def store(self, key, surface):
+        self.surfaces[key] = surface
+        self.bytes += surface.get_pitch() * surface.get_height()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "bytes": self.bytes, "entries": len(self.surfaces)}
+
+
+class Animation:
+    # Frames facing right and facing left, built once by AssetCache.animation. Picking the frame for
+    # a tick is two tuple lookups, so an animated sprite allocates nothing while it plays.
+    def __init__(self, right, left, ticks_per_frame):
+        self.frames = (tuple(left), tuple(right))
+        self.ticks_per_frame = ticks_per_frame
+        self.length = len(right) * ticks_per_frame
+
+    def frame(self, tick, facing_right):
+        return self.frames[facing_right][tick % self.length // self.ticks_per_frame]
+
+
+class AudioManager:
+    # Music tracks are only checked for on disk and streamed when their state starts. Sound effects
+    # are decoded once and played round-robin on a few reserved channels, so rapid fire cuts its
+    # own oldest voice instead of fighting over the default channels.
+    def __init__(self, assets, tracks, sounds, channels=4, volume=0.5):
+        self.enabled = pygame.mixer.get_init() is not None
+        self.volume = volume
+        self.tracks = {}
+        for state, name in tracks.items():
+            path = os.path.join("assets", name)
+            if os.path.isfile(path):
+                self.tracks[state] = path
+            else:
+                audio_log.warning("Couldn't find assets/%s, the %s screen will be silent", name, state)
+        self.current = None
+        self.sounds = {}
+        self.channels = []
+        self.next_channel = 0
+        if not self.enabled:
+            audio_log.warning("Audio disabled, the mixer isn't initialized")
+            return
+        for key, (name, sound_volume) in sounds.items():
+            try:
+                sound = assets.sound(name)
+            except pygame.error as e:
+                audio_log.warning("Couldn't load assets/%s. Error: %s", name, e)
+                continue
+            sound.set_volume(sound_volume)
+            self.sounds[key] = sound
+        pygame.mixer.set_reserved(channels)
+        self.channels = [pygame.mixer.Channel(i) for i in range(channels)]
+
+    def play_music(self, state):
+        path = self.tracks.get(state)
+        if not self.enabled or path is None:
+            return
+        if path == self.current and pygame.mixer.music.get_busy():
+            return
+        pygame.mixer.music.load(path)
+        pygame.mixer.music.set_volume(self.volume)
+        pygame.mixer.music.play(-1)
+        self.current = path
+
+    def stop_music(self):
+        if self.current:
+            pygame.mixer.music.stop()
+            self.current = None
+
+    def play(self, key):
+        sound = self.sounds.get(key)
+        if sound is None:
+            return
+        channel = self.channels[self.next_channel]
+        self.next_channel = (self.next_channel + 1) % len(self.channels)
+        channel.play(sound)
+
+
+class Camera:
+    # Entities live in world coordinates; only drawing applies the scroll offset
+    def __init__(self, world_width=WORLD_WIDTH, margin=ACTIVE_MARGIN):
+        self.world_width = world_width
+        self.margin = margin
+        self.x = 0
+        self.previous_x = 0
+        self.offset = 0  # Scroll used for drawing, between previous_x and x when interpolating
+        self.view = pygame.Rect(0, 0, WIDTH, HEIGHT)
+        self.active_area = self.view.inflate(margin * 2, margin * 2)
+
+    def reset(self, world_width=WORLD_WIDTH, x=0):
+        self.world_width = world_width
+        self.x = x
+        self.previous_x = x
+        self.view.x = x
+        self.active_area.centerx = self.view.centerx
+
+    def follow(self, rect):
+        # Scrolls forward only, keeping the target at the centre of the screen
+        target = min(rect.x - WIDTH // 2, self.world_width - WIDTH)
+        if target > self.x:
+            self.x = target
+            self.view.x = target
+            self.active_area.centerx = self.view.centerx
+
+    def blend(self, alpha):
+        self.offset = round(self.previous_x + (self.x - self.previous_x) * alpha)
+
+    def draw(self, queue, sprites):
+        x = self.offset
+        view = self.view
+        queue.extend((sprite.image, (sprite.rect.x - x, sprite.rect.y))
+                     for sprite in sprites if view.colliderect(sprite.rect))
+
+
+class RenderQueue:
+    # Collects a frame's blits in drawing order and hands them to the screen in one blits() call
+    def __init__(self):
+        self.commands = []
+
+    def add(self, surface, position):
+        self.commands.append((surface, position))
+
+    def extend(self, commands):
+        self.commands.extend(commands)
+
+    def flush(self, screen):
+        screen.blits(self.commands, False)
+        self.commands.clear()
+
+
+class HealthBars:
+    # One bar surface per whole pixel of fill, rendered once. pygame truncates a fractional fill
+    # width, so looking the bar up by the truncated width draws exactly what draw.rect did.
+    def __init__(self, width=30, height=5):
+        self.width = width
+        self.bars = []
+        for fill in range(width + 1):
+            bar = pygame.Surface((width, height))
+            bar.fill(RED)
+            bar.fill(GREEN, (0, 0, fill, height))
+            pygame.draw.rect(bar, BLACK, (0, 0, width, height), 1)
+            self.bars.append(bar.convert())
+        self.shield = pygame.Surface((39, 39))
+        self.shield.fill(MAGENTA)
+        pygame.draw.rect(self.shield, CYAN, (0, 0, 39, 39), 2)
+        self.shield.set_colorkey(MAGENTA, RLEACCEL)
+
+    def bar(self, health, max_health):
+        return self.bars[min(max(int(health / max_health * self.width), 0), self.width)]
+
+
+class TextCache:
+    # Rendered text surfaces keyed by (font, text, antialias, color), evicted least recently used first
+    def __init__(self, max_entries=256, max_bytes=8 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.surfaces = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, font, text, antialias, color):
+        key = (font, text, antialias, color)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return surface
+        self.misses += 1
+        surface = font.render(text, antialias, color)
+        self.surfaces[key] = surface
+        self.bytes += surface.get_pitch() * surface.get_height()
+        while len(self.surfaces) > self.max_entries or self.bytes > self.max_bytes:
+            _, evicted = self.surfaces.popitem(last=False)
+            self.bytes -= evicted.get_pitch() * evicted.get_height()
+        return surface
+
+
+class SpatialHash:
+    # Uniform grid broadphase: a query only looks at the cells a rect overlaps
+    def __init__(self, cell_size=64):
+        self.cell_size = cell_size
+        self.cells = {}
+
+    def clear(self):
+        self.cells.clear()
+
+    def insert(self, sprite):
+        size = self.cell_size
+        rect = sprite.rect
+        cells = self.cells
+        for cx in range(rect.left // size, (rect.right - 1) // size + 1):
+            for cy in range(rect.top // size, (rect.bottom - 1) // size + 1):
+                bucket = cells.get((cx, cy))
+                if bucket is None:
+                    cells[(cx, cy)] = [sprite]
+                else:
+                    bucket.append(sprite)
+
+    def rebuild(self, sprites):
+        self.cells.clear()
+        for sprite in sprites:
+            self.insert(sprite)
+
+    def query(self, rect):
+        size = self.cell_size
+        cells = self.cells
+        found = []
+        seen = set()
+        for cx in range(rect.left // size, (rect.right - 1) // size + 1):
+            for cy in range(rect.top // size, (rect.bottom - 1) // size + 1):
+                bucket = cells.get((cx, cy))
+                if bucket:
+                    for sprite in bucket:
+                        if sprite not in seen:
+                            seen.add(sprite)
+                            if sprite.rect.colliderect(rect):
+                                found.append(sprite)
+        return found
+
+
+class ScheduledEvent:
+    def __init__(self, due, period, callback, args):
+        self.due = due
+        self.period = period
+        self.callback = callback
+        self.args = args
+        self.active = True
+
+
+class Scheduler:
+    # Timer wheel counted in simulation ticks. An event sits in the slot of the tick it is due on,
+    # so advancing a tick only looks at that slot and the cost follows the events firing, not the
+    # entities alive. Events more than a turn away just wait in their slot for the right round.
+    def __init__(self, slots=256):
+        self.slots = [[] for _ in range(slots)]
+        self.tick = 0
+
+    def schedule(self, delay, callback, *args, period=0):
+        # Runs callback(*args) `delay` ticks from now, then every `period` ticks if one is given
+        event = ScheduledEvent(self.tick + max(delay, 1), max(period, 1) if period else 0, callback, args)
+        self.slots[event.due % len(self.slots)].append(event)
+        return event
+
+    def cancel(self, event):
+        # Cancelled events are dropped when their slot comes round
+        event.active = False
+
+    def clear(self):
+        for slot in self.slots:
+            slot.clear()
+
+    def advance(self):
+        self.tick += 1
+        tick = self.tick
+        slot = self.slots[tick % len(self.slots)]
+        if not slot:
+            return
+        due = [event for event in slot if event.due == tick]
+        slot[:] = [event for event in slot if event.due != tick]
+        for event in due:
+            if not event.active:
+                continue
+            event.callback(*event.args)
+            if event.period and event.active:
+                event.due += event.period
+                self.slots[event.due % len(self.slots)].append(event)
+
+
+class IntervalIndex:
+    # Static rects sorted by left edge. A query bisects to the first rect whose right edge could
+    # reach the query (none is wider than the widest) and scans until the lefts pass its right edge.
+    def __init__(self):
+        self.sprites = []
+        self.lefts = []
+        self.max_width = 0
+
+    def rebuild(self, sprites):
+        self.sprites = sorted(sprites, key=lambda sprite: sprite.rect.left)
+        self.lefts = [sprite.rect.left for sprite in self.sprites]
+        self.max_width = max((sprite.rect.width for sprite in self.sprites), default=0)
+
+    def query(self, rect):
+        sprites = self.sprites
+        found = []
+        for i in range(bisect_right(self.lefts, rect.left - self.max_width), len(sprites)):
+            sprite = sprites[i]
+            if sprite.rect.left >= rect.right:
+                break
+            if sprite.rect.colliderect(rect):
+                found.append(sprite)
+        return found
+
+
+class StaticLayer:
+    # Platforms painted once per level into tiles tile_width wide, each cropped to the height of the
+    # platforms it holds and colour keyed so the background shows through. A frame only queues the
+    # two or three tiles the camera overlaps.
+    def __init__(self, tile_width=512):
+        self.tile_width = tile_width
+        self.tiles = {}
+
+    def bake(self, platforms):
+        width = self.tile_width
+        columns = {}
+        for platform in platforms:
+            image = platform.render()
+            for column in range(platform.rect.left // width, (platform.rect.right - 1) // width + 1):
+                columns.setdefault(column, []).append((image, platform.rect))
+        self.tiles = {}
+        for column, members in columns.items():
+            top = min(rect.top for image, rect in members)
+            bottom = max(rect.bottom for image, rect in members)
+            tile = pygame.Surface((width, bottom - top))
+            tile.fill(MAGENTA)
+            tile.blits([(image, (rect.x - column * width, rect.y - top)) for image, rect in members], False)
+            tile.set_colorkey(MAGENTA, RLEACCEL)
+            self.tiles[column] = (tile, column * width, top)
+
+    def draw(self, queue, camera_x):
+        tiles = self.tiles
+        first = camera_x // self.tile_width
+        last = (camera_x + WIDTH - 1) // self.tile_width
+        queue.extend((tiles[column][0], (tiles[column][1] - camera_x, tiles[column][2]))
+                     for column in range(first, last + 1) if column in tiles)
+
+
+class FrameProfiler:
+    # Times named sections of each frame into a ring buffer. While disabled, measure() only
+    # forwards the call, so leaving it wired into the game loop costs almost nothing.
+    def __init__(self, sections, history=300):
+        self.sections = list(sections) + ["frame"]
+        self.history = history
+        self.samples = {name: array("q", [0]) * history for name in self.sections}
+        self.frames = 0
+        self.frame_start = 0
+        self.enabled = False
+        self.toggle_requested = False
+        self.font = None
+        self.overlay = []
+
+    def begin_frame(self):
+        if self.enabled:
+            slot = self.frames % self.history
+            for samples in self.samples.values():
+                samples[slot] = 0
+            self.frame_start = time.perf_counter_ns()
+
+    def measure(self, name, func, *args):
+        if not self.enabled:
+            return func(*args)
+        start = time.perf_counter_ns()
+        result = func(*args)
+        self.samples[name][self.frames % self.history] += time.perf_counter_ns() - start
+        return result
+
+    def end_frame(self):
+        if self.enabled:
+            self.samples["frame"][self.frames % self.history] = time.perf_counter_ns() - self.frame_start
+            self.frames += 1
+        # Toggling mid-frame would leave a half-measured sample, so it waits until the frame is closed
+        if self.toggle_requested:
+            self.toggle_requested = False
+            self.enabled = not self.enabled
+            self.overlay = []
+
+    def percentiles(self, name):
+        count = min(self.frames, self.history)
+        if count == 0:
+            return 0, 0
+        values = sorted(self.samples[name][:count])
+        return values[count // 2], values[count * 99 // 100]
+
+    def draw(self, screen):
+        if not self.enabled:
+            return
+        if self.font is None:
+            self.font = pygame.font.Font(None, 20)
+        # Re-rendering the numbers twice a second is enough to read them
+        if not self.overlay or self.frames % 30 == 0:
+            rows = [("section", "p50 ms", "p99 ms")]
+            for name in self.sections:
+                p50, p99 = self.percentiles(name)
+                rows.append((name, f"{p50 / 1e6:.2f}", f"{p99 / 1e6:.2f}"))
+            self.overlay = [[self.font.render(cell, True, WHITE) for cell in row] for row in rows]
+        panel = pygame.Rect(WIDTH - 230, 10, 220, len(self.overlay) * 16 + 10)
+        screen.fill(BLACK, panel)
+        for i, (name, p50, p99) in enumerate(self.overlay):
+            y = panel.y + 5 + i * 16
+            screen.blit(name, (panel.x + 5, y))
+            screen.blit(p50, (panel.x + 150 - p50.get_width(), y))
+            screen.blit(p99, (panel.right - 5 - p99.get_width(), y))
+
+    def dump_csv(self, path):
+        count = min(self.frames, self.history)
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["frame"] + [f"{name}_ms" for name in self.sections])
+            for frame in range(self.frames - count, self.frames):
+                slot = frame % self.history
+                writer.writerow([frame] + [f"{self.samples[name][slot] / 1e6:.3f}" for name in self.sections])
+        profile_log.info("Frame profile of %d frames written to %s", count, path)
+
+
+class Controls:
+    # Input for one simulation tick, whether it comes from the keyboard or a script
+    def __init__(self, dx=0, dy=0, jump=False, shoot=False):
+        self.dx = dx
+        self.dy = dy
+        self.jump = jump
+        self.shoot = shoot
+
+
+class Replay:
+    # The input of every tick of one run, plus what else decides how it plays out: the RNG seed,
+    # the starting level and the upgrades. A tick packs into one byte, so an hour of play is about
+    # 200 KB. The state digest at the end of the recorded run is kept to check playback against.
+    LEVEL_BYTES = 16
+    HEADER = struct.Struct(f"<4sHI{LEVEL_BYTES}sBI32s")
+    MAGIC = b"SSRP"
+    VERSION = 4  # Bumped whenever the simulation or the state digest changes, as older replays can't match
+    UPGRADES = ("faster_shooting", "faster_movement", "shield")
+
+    def __init__(self, level, seed=None, upgrades=(), inputs=None, digest=b""):
+        if len(level.encode("utf-8")) > self.LEVEL_BYTES:
+            raise ValueError(f"level key {level!r} is longer than the {self.LEVEL_BYTES} bytes a replay holds")
+        self.level = level
+        self.seed = random.getrandbits(32) if seed is None else seed
+        self.upgrades = [name for name in self.UPGRADES if name in upgrades]
+        self.playing = inputs is not None
+        self.inputs = inputs if inputs is not None else array("B")
+        self.digest = digest
+        self.position = 0
+        self.path = None  # Where a recording gets saved
+
+    @property
+    def finished(self):
+        return self.playing and self.position >= len(self.inputs)
+
+    def step(self, controls):
+        # Records the live input, or replaces it with the recorded one during playback
+        if not self.playing:
+            self.inputs.append((controls.dx + 1) | (controls.dy + 1) << 2 | bool(controls.jump) << 4
+                               | bool(controls.shoot) << 5)
+            return controls
+        if self.finished:
+            return Controls()
+        bits = self.inputs[self.position]
+        self.position += 1
+        return Controls((bits & 3) - 1, (bits >> 2 & 3) - 1, bool(bits & 16), bool(bits & 32))
+
+    def save(self, path, digest):
+        self.digest = digest
+        upgrades = sum(1 << i for i, name in enumerate(self.UPGRADES) if name in self.upgrades)
+        with open(path, "wb") as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.VERSION, self.seed, self.level.encode("utf-8"),
+                                     upgrades, len(self.inputs), digest))
+            f.write(self.inputs.tobytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, version, seed, level, upgrades, count, digest = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC:
+            raise ValueError(f"{path} is not a replay")
+        if version != cls.VERSION:
+            raise ValueError(f"{path} was recorded by a version {version} build; "
+                             f"this one only plays version {cls.VERSION} replays")
+        inputs = array("B", data[cls.HEADER.size:cls.HEADER.size + count])
+        return cls(level.rstrip(b"\0").decode("utf-8"), seed,
+                   [name for i, name in enumerate(cls.UPGRADES) if upgrades >> i & 1], inputs, digest)
+
+
+class LevelData:
+    # A levels/*.json file in compact form: platforms are flat (x, y, width, height) ints and
+    # enemies flat (x, y, shoot_rate) ints
+    HEADER = struct.Struct("<4sHq32s")
+    FIELDS = struct.Struct("<8i")
+    MAGIC = b"SSLV"
+    VERSION = 1
+
+    def __init__(self, key, name, world_width, background, bullet_damage, player_start, next_level, goal,
+                 platforms, enemies):
+        self.key = key
+        self.name = name
+        self.world_width = world_width
+        self.background = background
+        self.bullet_damage = bullet_damage
+        self.player_start = player_start
+        self.next_level = next_level
+        self.goal = goal
+        self.platforms = platforms
+        self.enemies = enemies
+
+    @classmethod
+    def from_json(cls, key, data):
+        platforms = array("i")
+        for rect in data["platforms"]:
+            platforms.extend(rect)
+        enemies = array("i")
+        for enemy in data["enemies"]:
+            enemies.extend((enemy["x"], enemy["y"], enemy.get("shoot_rate", 120)))
+        return cls(key, data.get("name", key), data.get("world_width", WORLD_WIDTH),
+                   data.get("background", "desert.png"), data.get("bullet_damage", 20),
+                   tuple(data.get("player_start", (100, 100))), data.get("next"), tuple(data["goal"]),
+                   platforms, enemies)
+
+    def to_bytes(self, mtime, digest):
+        strings = b""
+        for text in (self.name, self.background, self.next_level or ""):
+            encoded = text.encode("utf-8")
+            strings += struct.pack("<H", len(encoded)) + encoded
+        fields = self.FIELDS.pack(self.world_width, self.bullet_damage, *self.player_start, *self.goal,
+                                  len(self.platforms), len(self.enemies))
+        return (self.HEADER.pack(self.MAGIC, self.VERSION, mtime, digest) + fields + strings
+                + self.platforms.tobytes() + self.enemies.tobytes())
+
+    @classmethod
+    def from_bytes(cls, key, data):
+        offset = cls.HEADER.size
+        (world_width, bullet_damage, start_x, start_y, goal_x, goal_y, platform_count,
+         enemy_count) = cls.FIELDS.unpack_from(data, offset)
+        offset += cls.FIELDS.size
+        strings = []
+        for _ in range(3):
+            (length,) = struct.unpack_from("<H", data, offset)
+            offset += 2
+            strings.append(data[offset:offset + length].decode("utf-8"))
+            offset += length
+        platforms = array("i")
+        if (platform_count % 4 or enemy_count % 3 or platform_count < 0 or enemy_count < 0
+                or offset + (platform_count + enemy_count) * platforms.itemsize != len(data)):
+            raise ValueError(f"level data is {len(data)} bytes, expected {platform_count} platform and "
+                             f"{enemy_count} enemy ints after {offset}")
+        platforms.frombytes(data[offset:offset + platform_count * platforms.itemsize])
+        offset += platform_count * platforms.itemsize
+        enemies = array("i")
+        enemies.frombytes(data[offset:offset + enemy_count * enemies.itemsize])
+        name, background, next_level = strings
+        return cls(key, name, world_width, background, bullet_damage, (start_x, start_y), next_level or None,
+                   (goal_x, goal_y), platforms, enemies)
+
+
+class LevelLibrary:
+    # Compiles each levels/<key>.json once into levels/cache/<key>.bin. The cache is reused while the
+    # source mtime matches, or its content hash does; loaded levels stay in memory for respawns.
+    def __init__(self, directory="levels"):
+        self.directory = directory
+        self.cache_directory = os.path.join(directory, "cache")
+        self.levels = {}
+
+    def keys(self):
+        return sorted(name[:-len(".json")] for name in os.listdir(self.directory) if name.endswith(".json"))
+
+    def load(self, key):
+        level = self.levels.get(key)
+        if level is None:
+            level = self.levels[key] = self.compile(key)
+        return level
+
+    def compile(self, key):
+        source = os.path.join(self.directory, f"{key}.json")
+        cache = os.path.join(self.cache_directory, f"{key}.bin")
+        mtime = os.stat(source).st_mtime_ns
+        cached = None
+        try:
+            with open(cache, "rb") as f:
+                cached = f.read()
+            magic, version, cached_mtime, cached_digest = LevelData.HEADER.unpack_from(cached)
+            if magic != LevelData.MAGIC or version != LevelData.VERSION:
+                cached = None
+            elif cached_mtime == mtime:
+                return LevelData.from_bytes(key, cached)
+        except OSError:
+            cached = None
+        except (ValueError, struct.error) as e:
+            # A cache cut short or damaged is a miss, however well its header matches
+            level_log.warning("Level cache %s is damaged, recompiling. Error: %s", cache, e)
+            cached = None
+        with open(source, "rb") as f:
+            raw = f.read()
+        digest = hashlib.sha256(raw).digest()
+        level = None
+        if cached is not None and cached_digest == digest:
+            try:
+                level = LevelData.from_bytes(key, cached)
+            except (ValueError, struct.error) as e:
+                level_log.warning("Level cache %s is damaged, recompiling. Error: %s", cache, e)
+        if level is None:
+            level = LevelData.from_json(key, json.loads(raw))
+            level_log.info("Compiled %s into %s", source, cache)
+        try:
+            # Written aside and swapped in, so a crash mid-write never leaves a short cache behind
+            os.makedirs(self.cache_directory, exist_ok=True)
+            with open(cache + ".tmp", "wb") as f:
+                f.write(level.to_bytes(mtime, digest))
+            os.replace(cache + ".tmp", cache)
+        except OSError as e:
+            level_log.warning("Couldn't write level cache %s. Error: %s", cache, e)
+        return level
+
+
+class LevelSnapshot:
+    # The entity state of a level at one moment: where the camera and the player were, the enemy
+    # columns and the goals. Restoring it copies that state back onto the existing sprites, so a
+    # respawn or a checkpoint creates no surfaces and reads no files. Platforms never change.
+    def __init__(self, game):
+        self.camera_x = game.camera.x
+        self.player_pos = game.player.rect.topleft
+        self.enemies = game.enemies.snapshot()
+        self.goals = game.goals.sprites()
 
 
 class Player(pygame.sprite.Sprite):
     def __init__(self, x, y, game):
         super().__init__()
         self.game = game  # Reference to the Game instance
-        self.original_image = pygame.image.load(os.path.join("assets", "ninja.png")).convert_alpha()
-        self.original_image = pygame.transform.scale(self.original_image, (35, 35))
-        self.original_image = pygame.transform.flip(self.original_image, True, False)
-        self.image = self.original_image
+        idle = game.assets.animation(("ninja.png",), (35, 35))
+        self.animations = {"idle": idle}
+        for state, (names, ticks_per_frame) in PLAYER_ANIMATIONS.items():
+            try:
+                self.animations[state] = game.assets.animation(names, (35, 35), ticks_per_frame)
+            except pygame.error as e:
+                asset_log.warning("Couldn't load the %s animation, standing still instead. Error: %s", state, e)
+                self.animations[state] = idle
+        self.animation = self.animations["idle"]
+        self.animation_tick = 0
+        self.running = False
+        self.image = self.animation.frame(0, False)
         self.rect = self.image.get_rect()
         self.rect.x = x
         self.rect.y = y
+        self.previous_pos = (x, y)  # Position at the start of the tick, for interpolated drawing
         self.velocity_y = 0
         self.jumping = False
         self.facing_right = False
@@ -59,13 +911,13 @@ class Player(pygame.sprite.Sprite):
         self.max_health = 100
         self.speed = PLAYER_SPEED
         self.shoot_rate = 10
-        self.shoot_timer = 0
+        self.reloading = False
         self.shield_active = False
 
-    def update(self, platforms):
+    def update(self, platform_index):
         self.velocity_y += GRAVITY
         self.rect.y += self.velocity_y
-        collisions = pygame.sprite.spritecollide(self, platforms, False)
+        collisions = platform_index.query(self.rect)
         for platform in collisions:
             if self.velocity_y > 0:
                 self.rect.bottom = platform.rect.top
@@ -74,7 +926,17 @@ class Player(pygame.sprite.Sprite):
             elif self.velocity_y < 0:
                 self.rect.top = platform.rect.bottom
                 self.velocity_y = 0
-        self.rect.clamp_ip(pygame.Rect(0, 0, WIDTH, HEIGHT))
+        self.rect.clamp_ip(self.game.camera.view)
+        self.animate()
+
+    def animate(self):
+        # Runs while moving on the ground; the cycle restarts whenever the animation changes
+        animation = self.animations["run" if self.running and not self.jumping else "idle"]
+        if animation is not self.animation:
+            self.animation = animation
+            self.animation_tick = 0
+        self.image = animation.frame(self.animation_tick, self.facing_right)
+        self.animation_tick += 1
 
     def jump(self):
         if not self.jumping:
@@ -84,35 +946,30 @@ class Player(pygame.sprite.Sprite):
     def move(self, dx, dy):
         self.rect.x += dx * self.speed
         self.rect.y += dy * self.speed
-        if dx > 0 and not self.facing_right:
+        self.running = dx != 0
+        if dx > 0:
             self.facing_right = True
-            self.image = pygame.transform.flip(self.original_image, True, False)
-        elif dx < 0 and self.facing_right:
+        elif dx < 0:
             self.facing_right = False
-            self.image = self.original_image
-
-    def shoot(self, bullets, all_sprites):
-        if self.shoot_timer <= 0:
-            bullet = Bullet(self.rect.right if self.facing_right else self.rect.left,
-                            self.rect.centery, 1 if self.facing_right else -1, is_player_bullet=True)
-            bullets.add(bullet)
-            all_sprites.add(bullet)
-            # Play shoot sound if loaded
-            if self.game.shoot_sound_loaded:
-                self.game.shoot_sound.play()
-            self.shoot_timer = self.shoot_rate
-        else:
-            self.shoot_timer -= 1
-
-    def draw_health_bar(self, screen):
-        bar_width = 30
-        bar_height = 5
-        fill = (self.health / self.max_health) * bar_width
-        pygame.draw.rect(screen, RED, (self.rect.x, self.rect.y - 10, bar_width, bar_height))
-        pygame.draw.rect(screen, GREEN, (self.rect.x, self.rect.y - 10, fill, bar_height))
-        pygame.draw.rect(screen, BLACK, (self.rect.x, self.rect.y - 10, bar_width, bar_height), 1)
+
+    def shoot(self, projectiles):
+        if self.reloading:
+            return
+        projectiles.spawn(self.rect.right if self.facing_right else self.rect.left,
+                          self.rect.centery, 1 if self.facing_right else -1, ProjectileSystem.PLAYER)
+        self.game.audio.play("shoot")
+        self.reloading = True
+        # The shot's own tick plus shoot_rate ticks of reload, the cadence the old countdown gave
+        self.game.scheduler.schedule(self.shoot_rate + 1, self.reload)
+
+    def reload(self):
+        self.reloading = False
+
+    def draw_health_bar(self, queue, bars, x, y):
+        # x, y is where the sprite was drawn on screen, interpolated or not
+        queue.add(bars.bar(self.health, self.max_health), (x, y - 10))
         if self.shield_active:
-            pygame.draw.rect(screen, CYAN, (self.rect.x - 2, self.rect.y - 2, 39, 39), 2)
+            queue.add(bars.shield, (x - 2, y - 2))
 
     def activate_shield(self):
         self.shield_active = True
@@ -125,27 +982,31 @@ class Player(pygame.sprite.Sprite):
 
 
 class Platform(pygame.sprite.Sprite):
+    # Only a rect: the level's StaticLayer renders every platform once when the level is baked
     def __init__(self, x, y, width, height):
         super().__init__()
-        self.image = pygame.Surface((width, height))
-        self.image.fill(DARK_BROWN)
-        pygame.draw.rect(self.image, (100, 50, 0), (0, 0, width, height), 4)
+        self.rect = pygame.Rect(x, y, width, height)
+
+    def render(self):
+        width, height = self.rect.size
+        image = pygame.Surface((width, height))
+        image.fill(DARK_BROWN)
+        pygame.draw.rect(image, (100, 50, 0), (0, 0, width, height), 4)
         for i in range(0, width, 15):
-            pygame.draw.line(self.image, (120, 60, 0), (i, 0), (i, height), 2)
-        self.rect = self.image.get_rect()
-        self.rect.x = x
-        self.rect.y = y
+            pygame.draw.line(image, (120, 60, 0), (i, 0), (i, height), 2)
+        return image
 
 
 class Enemy(pygame.sprite.Sprite):
-    def __init__(self, x, y, shoot_rate=120):
+    # What EnemySystem draws and collides; its movement and timers live in the system's columns
+    def __init__(self, x, y, assets, shoot_rate=120):
         super().__init__()
+        self.assets = assets
         try:
-            self.image = pygame.image.load(os.path.join("assets", "sherif.png")).convert_alpha()
-            self.image = pygame.transform.scale(self.image, (35, 35))
+            self.image = assets.image("sherif.png", (35, 35))
             self.use_image = True
         except pygame.error as e:
-            print(f"Warning: Couldn't load assets/sherif.png, using fallback graphic. Error: {e}")
+            asset_log.warning("Couldn't load assets/sherif.png, using fallback graphic. Error: %s", e)
             self.image = pygame.Surface((30, 30), pygame.SRCALPHA)
             pygame.draw.polygon(self.image, RED, [(15, 0), (0, 30), (30, 30)])
             pygame.draw.circle(self.image, BLACK, (10, 10), 4)
@@ -156,73 +1017,467 @@ class Enemy(pygame.sprite.Sprite):
         self.rect.y = y
         self.health = 30
         self.max_health = 30
-        self.velocity_y = 0
-        self.shoot_timer = 0
         self.shoot_rate = shoot_rate
         self.can_move = random.choice([True, False])
-        self.move_direction = 1
-        self.move_speed = ENEMY_MOVE_SPEED
-        self.platform = None
+        self.index = None  # Slot in the EnemySystem holding it, None once removed
 
-    def update(self, platforms, player, enemy_bullets, all_sprites):
-        self.velocity_y += GRAVITY
-        self.rect.y += self.velocity_y
-        collisions = pygame.sprite.spritecollide(self, platforms, False)
-        for platform in collisions:
-            if self.velocity_y > 0:
-                self.rect.bottom = platform.rect.top
-                self.velocity_y = 0
-                self.platform = platform
-            elif self.velocity_y < 0:
-                self.rect.top = platform.rect.bottom
-                self.velocity_y = 0
-        if self.can_move and self.platform:
-            self.rect.x += self.move_direction * self.move_speed
-            if self.rect.right > self.platform.rect.right:
-                self.move_direction = -1
-            elif self.rect.left < self.platform.rect.left:
-                self.move_direction = 1
-        self.shoot_timer += 1
-        if self.shoot_timer >= self.shoot_rate:
-            direction = -1 if player.rect.x < self.rect.x else 1
-            bullet = Bullet(self.rect.centerx, self.rect.centery, direction, is_player_bullet=False)
-            bullet.image.fill(RED)
-            enemy_bullets.add(bullet)
-            all_sprites.add(bullet)
-            self.shoot_timer = 0
-
-    def draw_health_bar(self, screen):
-        bar_width = 30
-        bar_height = 5
-        fill = (self.health / self.max_health) * bar_width
-        pygame.draw.rect(screen, RED, (self.rect.x, self.rect.y - 10, bar_width, bar_height))
-        pygame.draw.rect(screen, GREEN, (self.rect.x, self.rect.y - 10, fill, bar_height))
-        pygame.draw.rect(screen, BLACK, (self.rect.x, self.rect.y - 10, bar_width, bar_height), 1)
-
-
-class Bullet(pygame.sprite.Sprite):
-    def __init__(self, x, y, direction, is_player_bullet=False):
-        super().__init__()
-        if is_player_bullet:
-            try:
-                self.image = pygame.image.load(os.path.join("assets", "balaninja.png")).convert_alpha()
-                self.image = pygame.transform.scale(self.image, (10, 5))
-            except pygame.error as e:
-                print(f"Warning: Couldn't load assets/balaninja.png, using fallback graphic. Error: {e}")
-                self.image = pygame.Surface((10, 5))
-                self.image.fill(YELLOW)
+    def alive(self):
+        # Enemies belong to an EnemySystem rather than to sprite groups
+        return self.index is not None
+
+    def draw_health_bar(self, queue, bars, camera_x):
+        queue.add(bars.bar(self.health, self.max_health), (self.rect.x - camera_x, self.rect.y - 10))
+
+
+class EnemySystem:
+    # Enemy state lives in parallel columns, like ProjectileSystem, and every awake enemy advances
+    # in one pass: a few NumPy operations when it is installed, a plain loop otherwise. The Enemy
+    # sprites are only a view for drawing and collisions; their rects are synced after each update.
+    # Enemies only ever fall. While one overlaps the platform it patrols it only tests that one;
+    # otherwise it queries the platform index like any falling body.
+    # Awake enemies fire through periodic scheduler events. When one falls asleep its event is
+    # cancelled and the ticks it had counted towards the next shot are kept in the timer column.
+    COLUMNS = (("x", "i"), ("y", "i"), ("vy", "d"), ("timer", "i"), ("rate", "i"), ("moving", "b"),
+               ("direction", "i"), ("landed", "b"), ("left", "i"), ("right", "i"), ("top", "i"),
+               ("bottom", "i"), ("active", "b"))
+    VECTORIZE_FROM = 16  # Below this many awake enemies NumPy's per-call overhead outweighs the loop
+
+    def __init__(self, scheduler, capacity=64):
+        self.scheduler = scheduler
+        self.capacity = capacity
+        self.count = 0
+        self.sprites = []
+        self.awake = []
+        self.firing = []
+        self.width = 35
+        self.height = 35
+        self.rect = pygame.Rect(0, 0, self.width, self.height)
+        for name, typecode in self.COLUMNS:
+            setattr(self, name, self.column(typecode, capacity))
+
+    @staticmethod
+    def column(typecode, size):
+        if np is not None:
+            return np.zeros(size, dtype=typecode)
+        return array(typecode, [0]) * size
+
+    def __iter__(self):
+        return iter(self.sprites)
+
+    def __len__(self):
+        return self.count
+
+    def grow(self):
+        self.capacity *= 2
+        for name, typecode in self.COLUMNS:
+            column = self.column(typecode, self.capacity)
+            column[:self.count] = getattr(self, name)[:self.count]
+            setattr(self, name, column)
+
+    def add(self, sprite):
+        if self.count == self.capacity:
+            self.grow()
+        i = self.count
+        self.width, self.height = sprite.rect.size
+        self.rect.size = sprite.rect.size
+        self.x[i] = sprite.rect.x
+        self.y[i] = sprite.rect.y
+        self.vy[i] = 0
+        self.timer[i] = 0
+        self.rate[i] = sprite.shoot_rate
+        self.moving[i] = sprite.can_move
+        self.direction[i] = 1
+        self.landed[i] = 0
+        self.active[i] = 0
+        sprite.index = i
+        sprite.fire_event = None
+        self.sprites.append(sprite)
+        self.count += 1
+
+    def remove(self, sprite):
+        # Rare (a kill), so the columns are shifted to keep the enemies in the order they were added
+        i = sprite.index
+        n = self.count
+        if sprite.fire_event:
+            self.scheduler.cancel(sprite.fire_event)
+        for name, _ in self.COLUMNS:
+            column = getattr(self, name)
+            column[i:n - 1] = column[i + 1:n]
+        del self.sprites[i]
+        for j in range(i, n - 1):
+            self.sprites[j].index = j
+        if sprite in self.awake:
+            self.awake.remove(sprite)
+        sprite.index = None
+        self.count -= 1
+
+    def clear(self):
+        for sprite in self.sprites:
+            if sprite.fire_event:
+                self.scheduler.cancel(sprite.fire_event)
+            sprite.index = None
+        self.count = 0
+        self.sprites = []
+        self.awake = []
+        self.firing = []
+
+    def snapshot(self):
+        # Copies of the live columns, with the countdowns of awake enemies read back from their
+        # events so that everyone starts asleep after a restore
+        n = self.count
+        columns = {}
+        for name, typecode in self.COLUMNS:
+            columns[name] = self.column(typecode, n)
+            columns[name][:] = getattr(self, name)[:n]
+        for i, sprite in enumerate(self.sprites):
+            if sprite.fire_event:
+                columns["timer"][i] = self.rate[i] - (sprite.fire_event.due - self.scheduler.tick)
+        columns["active"] = self.column("b", n)
+        return list(self.sprites), [sprite.health for sprite in self.sprites], columns
+
+    def restore(self, snapshot):
+        sprites, healths, columns = snapshot
+        self.clear()
+        n = len(sprites)
+        while self.capacity < n:
+            self.grow()
+        for name, _ in self.COLUMNS:
+            getattr(self, name)[:n] = columns[name]
+        for i, sprite in enumerate(sprites):
+            sprite.index = i
+            sprite.fire_event = None
+            sprite.health = healths[i]
+            sprite.rect.topleft = (int(self.x[i]), int(self.y[i]))
+        self.sprites = list(sprites)
+        self.count = n
+        return self.sprites
+
+    def update(self, active_area, platform_index):
+        # Only enemies within the active area move or shoot; the rest are frozen where they are.
+        # Runs before the scheduler advances, so enemies waking up this tick can fire on it.
+        n = self.count
+        x = self.x[:n]
+        y = self.y[:n]
+        if np is not None:
+            awake = ((x < active_area.right) & (x + self.width > active_area.left)
+                     & (y < active_area.bottom) & (y + self.height > active_area.top))
+            changed = np.flatnonzero(awake != (self.active[:n] != 0)).tolist()
+            self.active[:n] = awake
+            awake = np.flatnonzero(awake)
+            if awake.size >= self.VECTORIZE_FROM:
+                self.update_vectorized(awake, platform_index)
+                awake = awake.tolist()
+            else:
+                awake = awake.tolist()
+                self.update_loop(awake, platform_index)
         else:
-            self.image = pygame.Surface((10, 5))
-            self.image.fill(YELLOW)
-        self.rect = self.image.get_rect()
-        self.rect.x = x
-        self.rect.y = y
-        self.direction = direction
+            awake = []
+            changed = []
+            active = self.active
+            for i in range(n):
+                is_awake = (x[i] < active_area.right and x[i] + self.width > active_area.left
+                            and y[i] < active_area.bottom and y[i] + self.height > active_area.top)
+                if is_awake:
+                    awake.append(i)
+                if is_awake != bool(active[i]):
+                    active[i] = is_awake
+                    changed.append(i)
+            self.update_loop(awake, platform_index)
+        for i in changed:
+            if self.active[i]:
+                self.wake(i)
+            else:
+                self.sleep(i)
+        sprites = self.sprites
+        for i in awake:
+            sprites[i].rect.topleft = (int(self.x[i]), int(self.y[i]))
+        self.awake = [sprites[i] for i in awake]
+
+    def wake(self, i):
+        # Picks the countdown up where the enemy left it; an enemy fires after `rate` awake ticks
+        sprite = self.sprites[i]
+        rate = int(self.rate[i])
+        sprite.fire_event = self.scheduler.schedule(rate - int(self.timer[i]), self.fire, sprite, period=rate)
+
+    def sleep(self, i):
+        sprite = self.sprites[i]
+        self.timer[i] = self.rate[i] - (sprite.fire_event.due - self.scheduler.tick)
+        self.scheduler.cancel(sprite.fire_event)
+        sprite.fire_event = None
+
+    def fire(self, sprite):
+        self.firing.append(sprite)
+
+    def shoot(self, player, projectiles):
+        # Spawns the shots whose events fired this tick, in the order the enemies were added
+        if not self.firing:
+            return
+        self.firing.sort(key=lambda sprite: sprite.index)
+        for sprite in self.firing:
+            i = sprite.index
+            direction = -1 if player.rect.x < self.x[i] else 1
+            projectiles.spawn(int(self.x[i]) + self.width // 2, int(self.y[i]) + self.height // 2, direction,
+                              ProjectileSystem.ENEMY)
+        self.firing = []
+
+    def cull(self, camera_x):
+        # Enemies the camera has scrolled past never come back
+        n = self.count
+        if np is not None:
+            behind = np.flatnonzero(self.x[:n] + self.width < camera_x).tolist()
+        else:
+            behind = [i for i in range(n) if self.x[i] + self.width < camera_x]
+        for i in reversed(behind):
+            self.remove(self.sprites[i])
+
+    def fall(self, i, velocity, platform_index):
+        # A falling enemy lands on the first platform it touches, which becomes the one it patrols
+        rect = self.rect
+        rect.topleft = (int(self.x[i]), int(self.y[i]))
+        for platform in platform_index.query(rect):
+            rect.bottom = platform.rect.top
+            self.y[i] = rect.y
+            self.landed[i] = 1
+            self.left[i] = platform.rect.left
+            self.right[i] = platform.rect.right
+            self.top[i] = platform.rect.top
+            self.bottom[i] = platform.rect.bottom
+            return 0
+        return velocity
+
+    def update_vectorized(self, awake, platform_index):
+        width = self.width
+        height = self.height
+        velocity = self.vy[awake] + GRAVITY
+        y = self.y[awake] + velocity
+        # Same rounding as assigning a float to a Rect: halves go away from zero
+        y = np.trunc(y + np.copysign(0.5, y)).astype(self.y.dtype)
+        x = self.x[awake]
+        top = self.top[awake]
+        on_platform = ((self.landed[awake] != 0) & (x < self.right[awake]) & (x + width > self.left[awake])
+                       & (y < self.bottom[awake]))
+        hit = on_platform & (y + height > top)
+        y[hit] = top[hit] - height
+        velocity[hit] = 0
+        self.y[awake] = y
+        for j in np.flatnonzero(~on_platform).tolist():
+            velocity[j] = self.fall(awake[j], velocity[j], platform_index)
+        self.vy[awake] = velocity
+
+        walking = awake[(self.landed[awake] != 0) & (self.moving[awake] != 0)]
+        if walking.size:
+            direction = self.direction[walking]
+            x = self.x[walking] + direction * ENEMY_MOVE_SPEED
+            direction[x < self.left[walking]] = 1
+            direction[x + width > self.right[walking]] = -1
+            self.x[walking] = x
+            self.direction[walking] = direction
+
+    def update_loop(self, awake, platform_index):
+        rect = self.rect
+        for i in awake:
+            velocity = self.vy[i] + GRAVITY
+            rect.x = self.x[i]
+            rect.y = self.y[i]
+            rect.y += velocity
+            if (self.landed[i] and rect.x < self.right[i] and rect.right > self.left[i]
+                    and rect.y < self.bottom[i]):
+                if rect.bottom > self.top[i]:
+                    rect.bottom = self.top[i]
+                    velocity = 0
+                self.y[i] = rect.y
+            else:
+                self.y[i] = rect.y
+                velocity = self.fall(i, velocity, platform_index)
+            self.vy[i] = velocity
+            if self.landed[i] and self.moving[i]:
+                self.x[i] += self.direction[i] * ENEMY_MOVE_SPEED
+                if self.x[i] + self.width > self.right[i]:
+                    self.direction[i] = -1
+                elif self.x[i] < self.left[i]:
+                    self.direction[i] = 1
+
+    def state(self):
+        # Plain Python values, so a digest doesn't depend on whether NumPy did the update
+        n = self.count
+        timers = self.timer[:n].tolist()
+        for i, sprite in enumerate(self.sprites):
+            if sprite.fire_event:
+                timers[i] = int(self.rate[i]) - (sprite.fire_event.due - self.scheduler.tick)
+        columns = [self.x[:n].tolist(), self.y[:n].tolist(), self.vy[:n].tolist(), timers,
+                   self.direction[:n].tolist()]
+        return list(zip([sprite.health for sprite in self.sprites], *columns))
+
+
+class ProjectileSystem:
+    # Bullets live in preallocated columns instead of one sprite per shot, packed into slots
+    # [0, count) in the order they were fired. With NumPy installed a tick moves, culls and hit tests
+    # them all with a few array operations; otherwise, or while only a handful are live, a plain loop
+    # does the same. Either way removed slots are squeezed out keeping the order, so both paths
+    # leave the columns byte for byte the same.
+    PLAYER = 0
+    ENEMY = 1
+    VECTORIZE_FROM = 32  # Below this many live projectiles NumPy's per-call overhead outweighs the loop
+
+    def __init__(self, assets, capacity=4096):
+        self.capacity = capacity
+        self.count = 0
+        self.x = EnemySystem.column("f", capacity)
+        self.y = EnemySystem.column("f", capacity)
+        self.direction = EnemySystem.column("b", capacity)
+        self.owner = EnemySystem.column("b", capacity)
+        self.width = 10
+        self.height = 5
+        try:
+            player_image = assets.image("balaninja.png", (self.width, self.height))
+        except pygame.error as e:
+            asset_log.warning("Couldn't load assets/balaninja.png, using fallback graphic. Error: %s", e)
+            player_image = assets.solid((self.width, self.height), YELLOW)
+        self.images = (player_image, assets.solid((self.width, self.height), RED))
+        self.rect = pygame.Rect(0, 0, self.width, self.height)
+
+    def spawn(self, x, y, direction, owner):
+        if self.count >= self.capacity:
+            return False
+        i = self.count
+        self.x[i] = x
+        self.y[i] = y
+        self.direction[i] = direction
+        self.owner[i] = owner
+        self.count += 1
+        return True
+
+    def move(self, i, j):
+        self.x[j] = self.x[i]
+        self.y[j] = self.y[i]
+        self.direction[j] = self.direction[i]
+        self.owner[j] = self.owner[i]
+
+    def keep(self, mask):
+        # Vectorized removal: the slots where mask is set are packed to the front, in order
+        n = self.count
+        kept = int(np.count_nonzero(mask))
+        for column in (self.x, self.y, self.direction, self.owner):
+            column[:kept] = column[:n][mask]
+        self.count = kept
 
-    def update(self):
-        self.rect.x += self.direction * BULLET_SPEED
-        if self.rect.right < 0 or self.rect.left > WIDTH:
-            self.kill()
+    def vectorize(self):
+        return np is not None and self.count >= self.VECTORIZE_FROM
+
+    def positions(self):
+        # Slot rects' corners, truncated like the int() a Rect assignment does
+        n = self.count
+        return self.x[:n].astype(np.int32), self.y[:n].astype(np.int32)
+
+    def overlap(self, xs, ys, rect):
+        return (xs < rect.right) & (xs + self.width > rect.left) & (ys < rect.bottom) & (ys + self.height > rect.top)
+
+    def clear(self):
+        self.count = 0
+
+    def update(self, view):
+        left = view.left - self.width
+        right = view.right
+        if self.vectorize():
+            x = self.x[:self.count]
+            x += self.direction[:self.count] * BULLET_SPEED
+            self.keep((x >= left) & (x <= right))
+            return
+        x = self.x
+        direction = self.direction
+        kept = 0
+        for i in range(self.count):
+            x[i] += direction[i] * BULLET_SPEED
+            if left <= x[i] <= right:
+                if kept != i:
+                    self.move(i, kept)
+                kept += 1
+        self.count = kept
+
+    def collide_rect(self, owner, rect):
+        # Removes every projectile of this owner touching rect and returns how many there were
+        if self.vectorize():
+            xs, ys = self.positions()
+            hit = (self.owner[:self.count] == owner) & self.overlap(xs, ys, rect)
+            hits = int(np.count_nonzero(hit))
+            if hits:
+                self.keep(~hit)
+            return hits
+        hits = 0
+        kept = 0
+        for i in range(self.count):
+            if self.owner[i] == owner and self.hit_test(i, rect):
+                hits += 1
+            else:
+                if kept != i:
+                    self.move(i, kept)
+                kept += 1
+        self.count = kept
+        return hits
+
+    def collide_index(self, owner, index, on_hit):
+        # Each projectile calls on_hit for every live sprite of the index it overlaps, then disappears.
+        # Vectorized, the index is asked once for the sprites around all of this owner's projectiles
+        # and one sprites x projectiles mask holds every overlap. A sprite only ever changes by its own
+        # hits, so taking the hits sprite by sprite ends in the same state as projectile by projectile.
+        if self.vectorize():
+            mine = self.owner[:self.count] == owner
+            if not mine.any():
+                return
+            xs, ys = self.positions()
+            left = int(xs[mine].min())
+            top = int(ys[mine].min())
+            area = pygame.Rect(left, top, int(xs[mine].max()) + self.width - left,
+                               int(ys[mine].max()) + self.height - top)
+            sprites = [sprite for sprite in index.query(area) if sprite.alive()]
+            if not sprites:
+                return
+            left, top, width, height = np.array([tuple(sprite.rect) for sprite in sprites], dtype=np.int32).T[:, :, None]
+            candidates = np.flatnonzero(mine)
+            xs = xs[candidates]
+            ys = ys[candidates]
+            touching = ((xs < left + width) & (xs + self.width > left)
+                        & (ys < top + height) & (ys + self.height > top))
+            hit = np.zeros(self.count, dtype=bool)
+            for s, k in zip(*np.nonzero(touching)):
+                sprite = sprites[s]
+                if sprite.alive():
+                    on_hit(sprite)
+                    hit[candidates[k]] = True
+            if hit.any():
+                self.keep(~hit)
+            return
+        rect = self.rect
+        kept = 0
+        for i in range(self.count):
+            hit = False
+            if self.owner[i] == owner:
+                rect.x = int(self.x[i])
+                rect.y = int(self.y[i])
+                for sprite in index.query(rect):
+                    if sprite.alive():
+                        on_hit(sprite)
+                        hit = True
+            if not hit:
+                if kept != i:
+                    self.move(i, kept)
+                kept += 1
+        self.count = kept
+
+    def hit_test(self, i, rect):
+        self.rect.x = int(self.x[i])
+        self.rect.y = int(self.y[i])
+        return self.rect.colliderect(rect)
+
+    def draw(self, queue, camera_x):
+        images = self.images
+        if self.vectorize():
+            xs, ys = self.positions()
+            queue.extend(zip(map(images.__getitem__, self.owner[:self.count].tolist()),
+                             zip((xs - camera_x).tolist(), ys.tolist())))
+            return
+        queue.extend((images[self.owner[i]], (int(self.x[i]) - camera_x, int(self.y[i])))
+                     for i in range(self.count))
 
 
 class Goal(pygame.sprite.Sprite):
@@ -236,71 +1491,112 @@ class Goal(pygame.sprite.Sprite):
         self.rect.y = y
 
 
-class Menu:
-    def __init__(self, screen, font, small_font):
+class ButtonScreen:
+    # Base for Menu and LevelSelect. The background, title and idle buttons are baked once into a
+    # single layer, and each button's hover state into a small layer of its own, so a frame is
+    # one blit plus one more while a button is hovered.
+    def __init__(self, screen, title, title_font, small_font, assets, text_cache, buttons):
         self.screen = screen
-        self.font = pygame.font.Font(None, 100)  # Larger font for title
+        self.text_cache = text_cache
+        self.font = title_font
         self.small_font = small_font
         try:
-            self.background = pygame.image.load(os.path.join("assets", "naranja.png")).convert()
-            self.background = pygame.transform.scale(self.background, (WIDTH, HEIGHT))
+            self.background = assets.image("naranja.png", (WIDTH, HEIGHT), alpha=False)
             self.use_background = True
         except pygame.error as e:
-            print(f"Warning: Couldn't load assets/naranja.png, using fallback background. Error: {e}")
+            asset_log.warning("Couldn't load assets/naranja.png, using fallback background. Error: %s", e)
             self.background = pygame.Surface((WIDTH, HEIGHT))
             self.background.fill(SKY_BLUE)
             self.use_background = False
-        self.buttons = [
-            {"text": "Play", "action": "Play", "rect": pygame.Rect(WIDTH // 2 - 100, 200, 200, 50)},
-            {"text": "Levels", "action": "Levels", "rect": pygame.Rect(WIDTH // 2 - 100, 270, 200, 50)},
-            {"text": "Shop", "action": "Shop", "rect": pygame.Rect(WIDTH // 2 - 100, 340, 200, 50)},
-            {"text": "Credits", "action": "Credits", "rect": pygame.Rect(WIDTH // 2 - 100, 410, 200, 50)},
-            {"text": "Context", "action": "Context", "rect": pygame.Rect(WIDTH // 2 - 100, 480, 200, 50)},
-            {"text": "Quit", "action": "Quit", "rect": pygame.Rect(WIDTH // 2 - 100, 550, 200, 50)},
-        ]
-        self.title_text = self.font.render("Shuriken Sundown", True, WHITE)
-        self.title_shadow = self.font.render("Shuriken Sundown", True, BLACK)
-        self.title_glow = self.font.render("Shuriken Sundown", True, GLOW_YELLOW)
+        self.buttons = buttons
+        self.title_text = self.font.render(title, True, WHITE)
+        self.title_shadow = self.font.render(title, True, BLACK)
+        self.title_glow = self.font.render(title, True, GLOW_YELLOW)
+        self.drawn_hover = None
+        self.bake()
 
-    def draw(self):
-        if self.use_background:
-            self.screen.blit(self.background, (0, 0))
-        else:
-            self.screen.fill(SKY_BLUE)
+    def bake(self):
+        self.layer = self.background.copy()
+        self.draw_title(self.layer)
+        for button in self.buttons:
+            self.draw_button(self.layer, button, False, (0, 0))
+        self.hover_layers = []
+        for button in self.buttons:
+            area = button["rect"].union(button["rect"].move(4, 4)).clip(self.layer.get_rect())
+            hover_layer = self.layer.subsurface(area).copy()
+            self.draw_button(hover_layer, button, True, (-area.x, -area.y))
+            self.hover_layers.append((area, hover_layer))
+
+    def draw_title(self, surface):
         title_x = WIDTH // 2 - self.title_text.get_width() // 2
         title_y = 100
         for dx, dy in [(2, 2), (3, 3), (-2, 2), (2, -2)]:
-            self.screen.blit(self.title_shadow, (title_x + dx, title_y + dy))
+            surface.blit(self.title_shadow, (title_x + dx, title_y + dy))
         for dx, dy in [(1, 1), (-1, -1), (1, -1), (-1, 1), (2, 0), (-2, 0), (0, 2), (0, -2)]:
-            self.screen.blit(self.title_glow, (title_x + dx, title_y + dy))
-        self.screen.blit(self.title_text, (title_x, title_y))
-        pygame.draw.line(self.screen, YELLOW, (title_x, title_y - 10),
+            surface.blit(self.title_glow, (title_x + dx, title_y + dy))
+        surface.blit(self.title_text, (title_x, title_y))
+        pygame.draw.line(surface, YELLOW, (title_x, title_y - 10),
                          (title_x + self.title_text.get_width(), title_y - 10), 3)
-        pygame.draw.line(self.screen, YELLOW, (title_x, title_y + self.title_text.get_height() + 10),
+        pygame.draw.line(surface, YELLOW, (title_x, title_y + self.title_text.get_height() + 10),
                          (title_x + self.title_text.get_width(), title_y + self.title_text.get_height() + 10), 3)
         for x in [title_x, title_x + self.title_text.get_width()]:
-            pygame.draw.line(self.screen, YELLOW, (x, title_y - 10), (x, title_y - 20), 3)
-            pygame.draw.line(self.screen, YELLOW, (x, title_y + self.title_text.get_height() + 10),
+            pygame.draw.line(surface, YELLOW, (x, title_y - 10), (x, title_y - 20), 3)
+            pygame.draw.line(surface, YELLOW, (x, title_y + self.title_text.get_height() + 10),
                              (x, title_y + self.title_text.get_height() + 20), 3)
+
+    def draw_button(self, surface, button, is_hovered, offset):
+        rect = button["rect"].move(offset)
+        button_color = GRAY if is_hovered else DARK_BROWN
+        border_color = CYAN if is_hovered else YELLOW
+        shadow_rect = rect.copy()
+        shadow_rect.x += 4
+        shadow_rect.y += 4
+        pygame.draw.rect(surface, DARK_GRAY, shadow_rect)
+        pygame.draw.rect(surface, button_color, rect)
+        pygame.draw.rect(surface, border_color, rect, 4)
+        text_surface = self.text_cache.render(self.small_font, button["text"], True, WHITE)
+        text_shadow = self.text_cache.render(self.small_font, button["text"], True, BLACK)
+        text_rect = text_surface.get_rect(center=rect.center)
+        shadow_rect = text_rect.copy()
+        shadow_rect.x += 2
+        shadow_rect.y += 2
+        surface.blit(text_shadow, shadow_rect)
+        surface.blit(text_surface, text_rect)
+
+    def hovered_button(self):
         mouse_pos = pygame.mouse.get_pos()
-        for button in self.buttons:
-            is_hovered = button["rect"].collidepoint(mouse_pos)
-            button_color = GRAY if is_hovered else DARK_BROWN
-            border_color = CYAN if is_hovered else YELLOW
-            shadow_rect = button["rect"].copy()
-            shadow_rect.x += 4
-            shadow_rect.y += 4
-            pygame.draw.rect(self.screen, DARK_GRAY, shadow_rect)
-            pygame.draw.rect(self.screen, button_color, button["rect"])
-            pygame.draw.rect(self.screen, border_color, button["rect"], 4)
-            text_surface = self.small_font.render(button["text"], True, WHITE)
-            text_shadow = self.small_font.render(button["text"], True, BLACK)
-            text_rect = text_surface.get_rect(center=button["rect"].center)
-            shadow_rect = text_rect.copy()
-            shadow_rect.x += 2
-            shadow_rect.y += 2
-            self.screen.blit(text_shadow, shadow_rect)
-            self.screen.blit(text_surface, text_rect)
+        for i, button in enumerate(self.buttons):
+            if button["rect"].collidepoint(mouse_pos):
+                return i
+        return None
+
+    def draw(self):
+        self.screen.blit(self.layer, (0, 0))
+        hovered = self.hovered_button()
+        if hovered is not None:
+            area, hover_layer = self.hover_layers[hovered]
+            self.screen.blit(hover_layer, area)
+        self.drawn_hover = hovered
+
+    def refresh(self, full_redraw):
+        # Redraws only what changed since the last call and returns the dirty screen areas
+        if full_redraw:
+            self.draw()
+            return [self.screen.get_rect()]
+        hovered = self.hovered_button()
+        if hovered == self.drawn_hover:
+            return []
+        dirty = []
+        if self.drawn_hover is not None:
+            area = self.hover_layers[self.drawn_hover][0]
+            self.screen.blit(self.layer, area, area)
+            dirty.append(area)
+        if hovered is not None:
+            area, hover_layer = self.hover_layers[hovered]
+            self.screen.blit(hover_layer, area)
+            dirty.append(area)
+        self.drawn_hover = hovered
+        return dirty
 
     def update(self, event):
         if event.type == MOUSEBUTTONDOWN and event.button == 1:
@@ -311,81 +1607,34 @@ class Menu:
         return None
 
 
-class LevelSelect:
-    def __init__(self, screen, font, small_font):
-        self.screen = screen
-        self.font = font
-        self.small_font = small_font
-        try:
-            self.background = pygame.image.load(os.path.join("assets", "naranja.png")).convert()
-            self.background = pygame.transform.scale(self.background, (WIDTH, HEIGHT))
-            self.use_background = True
-        except pygame.error as e:
-            print(f"Warning: Couldn't load assets/naranja.png, using fallback background. Error: {e}")
-            self.background = pygame.Surface((WIDTH, HEIGHT))
-            self.background.fill(SKY_BLUE)
-            self.use_background = False
-        self.buttons = [
+class Menu(ButtonScreen):
+    def __init__(self, screen, font, small_font, assets, text_cache):
+        buttons = [
+            {"text": "Play", "action": "Play", "rect": pygame.Rect(WIDTH // 2 - 100, 200, 200, 50)},
+            {"text": "Levels", "action": "Levels", "rect": pygame.Rect(WIDTH // 2 - 100, 270, 200, 50)},
+            {"text": "Shop", "action": "Shop", "rect": pygame.Rect(WIDTH // 2 - 100, 340, 200, 50)},
+            {"text": "Credits", "action": "Credits", "rect": pygame.Rect(WIDTH // 2 - 100, 410, 200, 50)},
+            {"text": "Context", "action": "Context", "rect": pygame.Rect(WIDTH // 2 - 100, 480, 200, 50)},
+            {"text": "Quit", "action": "Quit", "rect": pygame.Rect(WIDTH // 2 - 100, 550, 200, 50)},
+        ]
+        title_font = pygame.font.Font(None, 100)  # Larger font for title
+        super().__init__(screen, "Shuriken Sundown", title_font, small_font, assets, text_cache, buttons)
+
+
+class LevelSelect(ButtonScreen):
+    def __init__(self, screen, font, small_font, assets, text_cache):
+        buttons = [
             {"text": "Level 1", "action": "Level1", "rect": pygame.Rect(WIDTH // 2 - 150, 250, 100, 100)},
             {"text": "Level 2", "action": "Level2", "rect": pygame.Rect(WIDTH // 2 + 50, 250, 100, 100)},
             {"text": "Back", "action": "Back", "rect": pygame.Rect(WIDTH // 2 - 100, 400, 200, 50)},
         ]
-        self.title_text = self.font.render("Select Level", True, WHITE)
-        self.title_shadow = self.font.render("Select Level", True, BLACK)
-        self.title_glow = self.font.render("Select Level", True, GLOW_YELLOW)
-
-    def draw(self):
-        if self.use_background:
-            self.screen.blit(self.background, (0, 0))
-        else:
-            self.screen.fill(SKY_BLUE)
-        title_x = WIDTH // 2 - self.title_text.get_width() // 2
-        title_y = 100
-        for dx, dy in [(2, 2), (3, 3), (-2, 2), (2, -2)]:
-            self.screen.blit(self.title_shadow, (title_x + dx, title_y + dy))
-        for dx, dy in [(1, 1), (-1, -1), (1, -1), (-1, 1), (2, 0), (-2, 0), (0, 2), (0, -2)]:
-            self.screen.blit(self.title_glow, (title_x + dx, title_y + dy))
-        self.screen.blit(self.title_text, (title_x, title_y))
-        pygame.draw.line(self.screen, YELLOW, (title_x, title_y - 10),
-                         (title_x + self.title_text.get_width(), title_y - 10), 3)
-        pygame.draw.line(self.screen, YELLOW, (title_x, title_y + self.title_text.get_height() + 10),
-                         (title_x + self.title_text.get_width(), title_y + self.title_text.get_height() + 10), 3)
-        for x in [title_x, title_x + self.title_text.get_width()]:
-            pygame.draw.line(self.screen, YELLOW, (x, title_y - 10), (x, title_y - 20), 3)
-            pygame.draw.line(self.screen, YELLOW, (x, title_y + self.title_text.get_height() + 10),
-                             (x, title_y + self.title_text.get_height() + 20), 3)
-        mouse_pos = pygame.mouse.get_pos()
-        for button in self.buttons:
-            is_hovered = button["rect"].collidepoint(mouse_pos)
-            button_color = GRAY if is_hovered else DARK_BROWN
-            border_color = CYAN if is_hovered else YELLOW
-            shadow_rect = button["rect"].copy()
-            shadow_rect.x += 4
-            shadow_rect.y += 4
-            pygame.draw.rect(self.screen, DARK_GRAY, shadow_rect)
-            pygame.draw.rect(self.screen, button_color, button["rect"])
-            pygame.draw.rect(self.screen, border_color, button["rect"], 4)
-            text_surface = self.small_font.render(button["text"], True, WHITE)
-            text_shadow = self.small_font.render(button["text"], True, BLACK)
-            text_rect = text_surface.get_rect(center=button["rect"].center)
-            shadow_rect = text_rect.copy()
-            shadow_rect.x += 2
-            shadow_rect.y += 2
-            self.screen.blit(text_shadow, shadow_rect)
-            self.screen.blit(text_surface, text_rect)
-
-    def update(self, event):
-        if event.type == MOUSEBUTTONDOWN and event.button == 1:
-            mouse_pos = event.pos
-            for button in self.buttons:
-                if button["rect"].collidepoint(mouse_pos):
-                    return button["action"]
-        return None
+        super().__init__(screen, "Select Level", font, small_font, assets, text_cache, buttons)
 
 
 class Context:
-    def __init__(self, screen, small_font):
+    def __init__(self, screen, small_font, text_cache):
         self.screen = screen
+        self.text_cache = text_cache
         self.context_font = pygame.font.Font(None, 20)
         self.small_font = small_font
         self.background = pygame.Surface((WIDTH, HEIGHT))
@@ -415,10 +1664,12 @@ class Context:
         self.timer = 0
         self.char_delay = 50
         self.animation_complete = False
-        self.text_surfaces = []
-        self.text_positions = []
-        self.prepare_text()
-        print("Context initialized with wrapped lines:", self.wrapped_lines)
+        self.line_height = 25
+        self.start_y = (HEIGHT - len(self.wrapped_lines) * self.line_height) // 2
+        # Finished lines are baked into the page; only the line being typed has its own surfaces
+        self.page = self.background.copy()
+        self.start_line()
+        context_log.debug("Context initialized with %d wrapped lines", len(self.wrapped_lines))
 
     def create_background(self):
         for y in range(HEIGHT // 2):
@@ -440,8 +1691,7 @@ class Context:
             current_chars = []
             for word in words:
                 test_line = current_line + word + " "
-                test_surface = self.context_font.render(test_line, True, WHITE)
-                if test_surface.get_width() <= max_width:
+                if self.context_font.size(test_line)[0] <= max_width:
                     current_line = test_line
                     current_chars.extend(list(word + " "))
                 else:
@@ -453,64 +1703,72 @@ class Context:
             if current_line:
                 self.wrapped_lines.append(current_line.strip())
                 self.chars_per_line.append(current_chars)
-        print("Wrapped lines:", self.wrapped_lines)
-
-    def prepare_text(self):
-        self.text_surfaces = []
-        self.text_positions = []
-        line_height = 25
-        total_height = len(self.wrapped_lines) * line_height
-        start_y = (HEIGHT - total_height) // 2
-        for i in range(len(self.wrapped_lines)):
-            if i < self.current_line:
-                text_to_show = self.wrapped_lines[i]
-            elif i == self.current_line and not self.animation_complete:
-                chars_to_show = self.chars_per_line[i][:self.current_char]
-                text_to_show = "".join(chars_to_show)
-            else:
-                text_to_show = ""
-            try:
-                text_surface = self.context_font.render(text_to_show, True, WHITE)
-                text_shadow = self.context_font.render(text_to_show, True, BLACK)
-                text_rect = text_surface.get_rect(center=(WIDTH // 2, start_y + i * line_height))
-                self.text_surfaces.append((text_surface, text_shadow))
-                self.text_positions.append(text_rect)
-                print(f"Line {i}: Rendering '{text_to_show}' at {text_rect}")
-            except Exception as e:
-                print(f"Error rendering line {i}: {e}")
-
-    def update(self):
-        if self.animation_complete:
+        context_log.debug("Wrapped lines: %s", self.wrapped_lines)
+
+    def start_line(self):
+        chars = self.chars_per_line[self.current_line]
+        text = self.wrapped_lines[self.current_line]
+        self.line_rect = pygame.Rect((0, 0), self.context_font.size(text))
+        self.line_rect.center = (WIDTH // 2, self.start_y + self.current_line * self.line_height)
+        self.line_text = pygame.Surface(self.line_rect.size, pygame.SRCALPHA)
+        self.line_shadow = pygame.Surface(self.line_rect.size, pygame.SRCALPHA)
+        # x offset of every character, from the glyph advances measured once per line
+        self.char_offsets = []
+        x = 0
+        for char, metrics in zip(chars, self.context_font.metrics("".join(chars))):
+            self.char_offsets.append(x)
+            x += metrics[4] if metrics else self.context_font.size(char)[0]
+
+    def reveal_char(self):
+        char = self.chars_per_line[self.current_line][self.current_char]
+        x = self.char_offsets[self.current_char]
+        self.line_text.blit(self.text_cache.render(self.context_font, char, True, WHITE), (x, 0))
+        self.line_shadow.blit(self.text_cache.render(self.context_font, char, True, BLACK), (x, 0))
+
+    def finish_line(self):
+        # The whole line is rendered once more so the page matches a single render exactly
+        text = self.wrapped_lines[self.current_line]
+        try:
+            text_surface = self.context_font.render(text, True, WHITE)
+            text_shadow = self.context_font.render(text, True, BLACK)
+        except pygame.error as e:
+            context_log.error("Error rendering line %d: %s", self.current_line, e)
             return
-        self.timer += 1000 / FPS
-        if self.timer >= self.char_delay:
-            self.timer = 0
-            if self.current_line < len(self.wrapped_lines):
-                total_chars = sum(len(chars) for chars in self.chars_per_line)
-                if self.current_char < len(self.chars_per_line[self.current_line]):
-                    self.current_char += 1
-                    print(
-                        f"Line {self.current_line}, Char {self.current_char}: {self.chars_per_line[self.current_line][self.current_char - 1]}")
-                elif self.current_line + 1 < len(self.wrapped_lines):
+        self.page.blit(text_shadow, self.line_rect.move(2, 2))
+        self.page.blit(text_surface, self.line_rect)
+
+    def update(self, dt):
+        # Reveals one character per char_delay ms of real time, however fast the screen is drawn.
+        # Long stalls are capped like in gameplay so the story never appears all at once.
+        self.timer += min(dt, MAX_FRAME_MS)
+        while self.timer >= self.char_delay and not self.animation_complete:
+            self.timer -= self.char_delay
+            chars = self.chars_per_line[self.current_line]
+            if self.current_char < len(chars):
+                self.reveal_char()
+                self.current_char += 1
+                context_log.debug("Line %d, Char %d: %s", self.current_line, self.current_char,
+                                  chars[self.current_char - 1])
+            else:
+                self.finish_line()
+                if self.current_line + 1 < len(self.wrapped_lines):
                     self.current_line += 1
                     self.current_char = 0
-                    print(f"Moving to line {self.current_line}")
-                if self.current_char >= total_chars:
+                    self.start_line()
+                    context_log.debug("Moving to line %d", self.current_line)
+                else:
                     self.animation_complete = True
-                    print("Animation complete")
-            self.prepare_text()
+                    context_log.debug("Animation complete")
 
     def draw(self):
-        self.screen.blit(self.background, (0, 0))
-        for (text_surface, text_shadow), text_rect in zip(self.text_surfaces, self.text_positions):
-            shadow_rect = text_rect.copy()
-            shadow_rect.x += 2
-            shadow_rect.y += 2
-            self.screen.blit(text_shadow, shadow_rect)
-            self.screen.blit(text_surface, text_rect)
-        if self.animation_complete:
-            instruction = self.small_font.render("Presiona ENTER para volver al menú", True, WHITE)
-            instruction_shadow = self.small_font.render("Presiona ENTER para volver al menú", True, BLACK)
+        self.screen.blit(self.page, (0, 0))
+        if not self.animation_complete:
+            self.screen.blit(self.line_shadow, self.line_rect.move(2, 2))
+            self.screen.blit(self.line_text, self.line_rect)
+        else:
+            instruction = self.text_cache.render(self.small_font, "Presiona ENTER para volver al menú", True, WHITE)
+            instruction_shadow = self.text_cache.render(self.small_font, "Presiona ENTER para volver al menú", True,
+                                                        BLACK)
             instruction_rect = instruction.get_rect(center=(WIDTH // 2, HEIGHT - 30))
             shadow_rect = instruction_rect.copy()
             shadow_rect.x += 2
@@ -520,8 +1778,10 @@ class Context:
 
 
 class Shop:
-    def __init__(self, screen, font, small_font, total_score, upgrades):
+    def __init__(self, screen, font, small_font, total_score, upgrades, assets, text_cache):
         self.screen = screen
+        self.assets = assets
+        self.text_cache = text_cache
         self.font = font
         self.small_font = small_font
         self.total_score = total_score
@@ -556,16 +1816,33 @@ class Shop:
         button_height = return_rect.height + padding_y * 2
         return_button_rect = pygame.Rect(WIDTH // 2 - button_width // 2, current_y, button_width, button_height)
         self.buttons.append({"rect": return_button_rect, "action": "menu", "index": None, "text": return_text})
+        self.drawn_hover = None
+
+    def hovered_button(self):
+        mouse_pos = pygame.mouse.get_pos()
+        for i, button in enumerate(self.buttons):
+            if button["rect"].collidepoint(mouse_pos):
+                return i
+        return None
+
+    def refresh(self, full_redraw):
+        # The shop only changes on hover or purchase; anything else keeps the last frame
+        hovered = self.hovered_button()
+        if not full_redraw and hovered == self.drawn_hover:
+            return []
+        self.draw()
+        self.drawn_hover = hovered
+        return [self.screen.get_rect()]
 
     def draw(self):
         try:
-            shop_background = pygame.image.load(os.path.join("assets", "menutienda.png")).convert_alpha()
-            shop_background = pygame.transform.scale(shop_background, (WIDTH, HEIGHT))
+            shop_background = self.assets.image("menutienda.png", (WIDTH, HEIGHT))
             self.screen.blit(shop_background, (0, 0))
         except pygame.error as e:
-            print(f"Warning: Couldn't load assets/menutienda.png, using fallback. Error: {e}")
+            asset_log.warning("Couldn't load assets/menutienda.png, using fallback. Error: %s", e)
             self.screen.fill(DARK_BROWN)
-        score_text = self.small_font.render(f"★ Puntos totales: {self.total_score} ★", True, YELLOW)
+        score_text = self.text_cache.render(self.small_font, f"★ Puntos totales: {self.total_score} ★", True,
+                                            YELLOW)
         score_rect = score_text.get_rect(center=(WIDTH // 2, 150))
         pygame.draw.rect(self.screen, BLACK,
                          (score_rect.x - 10, score_rect.y - 5, score_rect.width + 20, score_rect.height + 10), 2)
@@ -583,11 +1860,11 @@ class Shop:
             pygame.draw.rect(self.screen, border_color, button["rect"], 4)
             text_str = button["text"]
             if button["action"] == "menu":
-                text = self.small_font.render(text_str, True, WHITE)
+                text = self.text_cache.render(self.small_font, text_str, True, WHITE)
             else:
                 option = self.options[button["index"]]
-                text = self.small_font.render(text_str, True, PURPLE if option["purchased"] else WHITE)
-            text_shadow = self.small_font.render(text_str, True, BLACK)
+                text = self.text_cache.render(self.small_font, text_str, True, PURPLE if option["purchased"] else WHITE)
+            text_shadow = self.text_cache.render(self.small_font, text_str, True, BLACK)
             text_rect = text.get_rect(center=button["rect"].center)
             shadow_rect = text_rect.copy()
             shadow_rect.x += 2
@@ -614,41 +1891,50 @@ class Shop:
 
 
 class Game:
-    def __init__(self):
+    def __init__(self, headless=False):
         # Initialize display
+        self.headless = headless
         self.screen = pygame.display.set_mode((WIDTH, HEIGHT))
         pygame.display.set_caption("Shuriken Sundown")
+        self.assets = AssetCache()
+        self.assets.load_atlas()
 
-        # Display loading screen
-        try:
-            loading_image = pygame.image.load(os.path.join("assets", "loading.png")).convert_alpha()
-            loading_image = pygame.transform.scale(loading_image, (WIDTH, HEIGHT))
-            self.screen.blit(loading_image, (0, 0))
-            pygame.display.flip()
-        except pygame.error as e:
-            print(f"Warning: Couldn't load assets/loading.png, using fallback background. Error: {e}")
-            self.screen.fill(BLACK)
-            loading_text = pygame.font.Font(None, 80).render("Loading...", True, WHITE)
-            loading_rect = loading_text.get_rect(center=(WIDTH // 2, HEIGHT // 2))
-            self.screen.blit(loading_text, loading_rect)
+        # Display loading screen and wait for the startup assets (skipped when running headless)
+        if not headless:
+            try:
+                self.loading_image = self.assets.image("loading.png", (WIDTH, HEIGHT))
+            except pygame.error as e:
+                asset_log.warning("Couldn't load assets/loading.png, using fallback background. Error: %s", e)
+                self.loading_image = pygame.Surface((WIDTH, HEIGHT))
+                self.loading_image.fill(BLACK)
+                loading_text = pygame.font.Font(None, 80).render("Loading...", True, WHITE)
+                loading_rect = loading_text.get_rect(center=(WIDTH // 2, HEIGHT // 2))
+                self.loading_image.blit(loading_text, loading_rect)
+            self.screen.blit(self.loading_image, (0, 0))
             pygame.display.flip()
-
-        # Wait for 4 seconds
-        pygame.time.wait(4000)
+            self.preload(STARTUP_ASSETS, GAMEPLAY_ASSETS)
 
         # Initialize rest of the game
         self.clock = pygame.time.Clock()
         self.state = "menu"
-        self.all_sprites = pygame.sprite.Group()
+        self.drawn_state = None
+        self.accumulator = 0
+        self.interpolate = False
+        self.jump_queued = False
+        self.replay = None
+        self.record_path = None  # When set, every run started is recorded, see next_record_path
+        self.recorded_runs = 0
+        self.session_upgrades = None  # The shop's upgrades, put aside while a replay plays
         self.platforms = pygame.sprite.Group()
-        self.enemies = pygame.sprite.Group()
-        self.bullets = pygame.sprite.Group()
-        self.enemy_bullets = pygame.sprite.Group()
+        self.scheduler = Scheduler()
+        self.enemies = EnemySystem(self.scheduler)
+        self.projectiles = ProjectileSystem(self.assets)
         self.goals = pygame.sprite.Group()
         self.player = None
+        self.text_cache = TextCache()
         self.font = pygame.font.Font(None, 80)
         self.small_font = pygame.font.Font(None, 40)
-        self.menu = Menu(self.screen, self.font, self.small_font)
+        self.menu = Menu(self.screen, self.font, self.small_font, self.assets, self.text_cache)
         self.shop = None
         self.context = None
         self.level_select = None
@@ -656,198 +1942,211 @@ class Game:
         self.total_score = 0
         self.upgrades = {}
         self.lives = 3
-        self.scroll_x = 0
+        self.camera = Camera()
+        self.profiler = FrameProfiler(["input", "physics", "ai", "collisions", "render", "display", "wait"])
+        self.platform_index = IntervalIndex()
+        self.static_layer = StaticLayer()
+        self.enemy_index = SpatialHash()
+        self.render_queue = RenderQueue()
+        self.health_bars = HealthBars()
+        self.levels = LevelLibrary()
+        self.level = None
+        self.snapshot = None
+        self.background = self.load_background("desert.png")
         try:
-            self.background = pygame.image.load(os.path.join("assets", "desert.png")).convert()
-            self.background = pygame.transform.scale(self.background, (WIDTH, HEIGHT))
+            self.heart_image = self.assets.image("vida1.png", (32, 32))
         except pygame.error as e:
-            print(f"Warning: Couldn't load assets/desert.png, using fallback background. Error: {e}")
-            self.background = pygame.Surface((WIDTH, HEIGHT))
-            self.background.fill(SKY_BLUE)
-            pygame.draw.rect(self.background, RED, (0, HEIGHT - 40, WIDTH, 40))
-        try:
-            self.heart_image = pygame.image.load(os.path.join("assets", "vida1.png")).convert_alpha()
-            self.heart_image = pygame.transform.scale(self.heart_image, (32, 32))
-        except pygame.error as e:
-            print(f"Warning: Couldn't load assets/vida1.png, using fallback heart. Error: {e}")
+            asset_log.warning("Couldn't load assets/vida1.png, using fallback heart. Error: %s", e)
             self.heart_image = pygame.Surface((32, 32), pygame.SRCALPHA)
             pygame.draw.polygon(self.heart_image, RED,
                                 [(16, 8), (8, 0), (0, 8), (8, 16), (16, 24), (24, 16), (32, 8), (24, 0)])
         try:
-            self.gameover_image = pygame.image.load(os.path.join("assets", "gameover.png")).convert_alpha()
-            self.gameover_image = pygame.transform.scale(self.gameover_image, (WIDTH, HEIGHT))
+            self.gameover_image = self.assets.image("gameover.png", (WIDTH, HEIGHT))
             self.use_gameover_image = True
         except pygame.error as e:
-            print(f"Warning: Couldn't load assets/gameover_image.png, using fallback text screen. Error: {e}")
+            asset_log.warning("Couldn't load assets/gameover_image.png, using fallback text screen. Error: %s", e)
             self.use_gameover_image = False
         try:
-            self.credits_image = pygame.image.load(os.path.join("assets", "creditsns.png")).convert_alpha()
-            self.credits_image = pygame.transform.scale(self.credits_image, (WIDTH, HEIGHT))
+            self.credits_image = self.assets.image("creditsns.png", (WIDTH, HEIGHT))
             self.use_credits_image = True
         except pygame.error as e:
-            print(f"Warning: Couldn't load assets/creditsns.png, using fallback text screen. Error: {e}")
+            asset_log.warning("Couldn't load assets/creditsns.png, using fallback text screen. Error: %s", e)
             self.use_credits_image = False
         try:
-            self.win_image = pygame.image.load(os.path.join("assets", "win.png")).convert_alpha()
-            self.win_image = pygame.transform.scale(self.win_image, (WIDTH, HEIGHT))
+            self.win_image = self.assets.image("win.png", (WIDTH, HEIGHT))
             self.use_win_image = True
         except pygame.error as e:
-            print(f"Warning: Couldn't load assets/win.png, using fallback text screen. Error: {e}")
+            asset_log.warning("Couldn't load assets/win.png, using fallback text screen. Error: %s", e)
             self.use_win_image = False
-        # Initialize menu music
-        self.menu_music_loaded = False
-        try:
-            pygame.mixer.music.load(os.path.join("assets", "musicamenu.mp3"))
-            self.menu_music_loaded = True
-        except pygame.error as e:
-            print(f"Warning: Couldn't load assets/musicamenu.mp3. Error: {e}")
-        # Initialize play music
-        self.play_music_loaded = False
-        try:
-            pygame.mixer.music.load(os.path.join("assets", "musicaplay.mp3"))
-            self.play_music_loaded = True
-        except pygame.error as e:
-            print(f"Warning: Couldn't load assets/musicaplay.mp3. Error: {e}")
-        # Initialize context music
-        self.context_music_loaded = False
-        try:
-            pygame.mixer.music.load(os.path.join("assets", "teclado.mp3"))
-            self.context_music_loaded = True
-        except pygame.error as e:
-            print(f"Warning: Couldn't load assets/teclado.mp3. Error: {e}")
-        # Initialize shoot sound
-        self.shoot_sound_loaded = False
-        try:
-            self.shoot_sound = pygame.mixer.Sound(os.path.join("assets", "disparo.mp3"))
-            self.shoot_sound.set_volume(0.5)
-            self.shoot_sound_loaded = True
-        except pygame.error as e:
-            print(f"Warning: Couldn't load assets/disparo.mp3. Error: {e}")
+        self.audio = AudioManager(self.assets, MUSIC, SOUNDS)
+
+    def preload(self, startup, later):
+        # Draws a progress bar until every startup file is decoded, then hands over to the menu
+        # while the rest keep loading in the background
+        start = time.perf_counter()
+        futures = self.assets.preload(startup)
+        self.assets.preload(later)
+        bar = pygame.Rect(WIDTH // 4, HEIGHT - 60, WIDTH // 2, 16)
+        clock = pygame.time.Clock()
+        while True:
+            for event in pygame.event.get():
+                if event.type == QUIT:
+                    pygame.quit()
+                    sys.exit()
+            done = sum(future.done() for future in futures)
+            fill = bar.inflate(-4, -4)
+            if futures:  # Empty when the atlas holds every startup file
+                fill.width = fill.width * done // len(futures)
+            self.screen.blit(self.loading_image, bar, bar)
+            pygame.draw.rect(self.screen, WHITE, bar, 2)
+            pygame.draw.rect(self.screen, WHITE, fill)
+            pygame.display.update(bar)
+            if done == len(futures):
+                break
+            clock.tick(FPS)
+        for name in startup:
+            if name in self.assets.timings:
+                asset_log.info("Preloaded %s in %.1f ms", name, self.assets.timings[name])
+        asset_log.info("Startup assets ready in %.1f ms", (time.perf_counter() - start) * 1000)
 
     def reset_game(self):
-        self.all_sprites.empty()
+        self.load_level("level1")
+
+    def reset_final_level(self):
+        self.load_level("level2")
+
+    def start_run(self, name, replay=None):
+        # Starts a level from scratch with a new player. A run that is recorded or played back
+        # seeds the RNG first so the enemies come out the same every time.
+        if replay is None and self.record_path:
+            try:
+                replay = Replay(name, upgrades=self.upgrades)
+                replay.path = self.next_record_path()
+            except ValueError as e:
+                replay_log.warning("Not recording this run: %s", e)
+        self.replay = replay
+        if replay:
+            random.seed(replay.seed)
+            if replay.playing:
+                # The recorded upgrades only last for the playback; finish_replay gives the
+                # session's own back
+                self.session_upgrades = self.upgrades
+                self.upgrades = dict.fromkeys(replay.upgrades, True)
+        self.state = "playing" if name == "level1" else "final_level"
+        self.score = 0
+        self.lives = 3
+        self.player = None
+        self.load_level(name)
+
+    def finish_replay(self):
+        digest = self.state_hash()
+        replay = self.replay
+        self.replay = None
+        if replay.playing:
+            self.upgrades = self.session_upgrades
+            if digest == replay.digest:
+                replay_log.info("Replay finished after %d ticks, state %s matches", len(replay.inputs),
+                                digest.hex()[:16])
+            else:
+                replay_log.warning("Replay diverged: state %s, recorded %s", digest.hex()[:16],
+                                   replay.digest.hex()[:16])
+            return digest == replay.digest
+        replay.save(replay.path, digest)
+        replay_log.info("Replay of %d ticks written to %s", len(replay.inputs), replay.path)
+        return True
+
+    def next_record_path(self):
+        # The first run of a session goes to record_path itself, later ones to name-2.ext, name-3.ext...
+        self.recorded_runs += 1
+        if self.recorded_runs == 1:
+            return self.record_path
+        stem, extension = os.path.splitext(self.record_path)
+        return f"{stem}-{self.recorded_runs}{extension}"
+
+    def state_hash(self):
+        # Digest of everything the simulation carries from one tick to the next
+        player = self.player
+        state = [self.state, self.level.key, self.score, self.lives, self.camera.x,
+                 player.rect.topleft, player.velocity_y, player.health, player.reloading,
+                 player.jumping, player.facing_right, player.shield_active]
+        state.extend(self.enemies.state())
+        projectiles = self.projectiles
+        for column in (projectiles.x, projectiles.y, projectiles.direction, projectiles.owner):
+            state.append(column[:projectiles.count].tobytes())
+        return hashlib.sha256(repr(state).encode("utf-8")).digest()
+
+    def load_level(self, name):
+        level = self.levels.load(name)
+        self.level = level
         self.platforms.empty()
-        self.enemies.empty()
-        self.bullets.empty()
-        self.enemy_bullets.empty()
+        self.enemies.clear()
+        self.projectiles.clear()
         self.goals.empty()
-        self.scroll_x = 0
-        if self.player:
-            self.player.rect.x = 100
-            self.player.rect.y = 100
-            self.player.velocity_y = 0
-            self.player.health = self.player.max_health
-            self.player.shoot_rate = 5 if "faster_shooting" in self.upgrades else 10
-            self.player.speed = 7 if "faster_movement" in self.upgrades else PLAYER_SPEED
-            if "shield" in self.upgrades:
-                self.player.activate_shield()
-            self.all_sprites.add(self.player)
-        else:
-            self.player = Player(100, 100, self)
-            self.player.shoot_rate = 5 if "faster_shooting" in self.upgrades else 10
-            self.player.speed = 7 if "faster_movement" in self.upgrades else PLAYER_SPEED
-            if "shield" in self.upgrades:
-                self.player.activate_shield()
-            self.all_sprites.add(self.player)
-        platforms = [
-            Platform(100, 150, 150, 20),
-            Platform(300, 200, 150, 20),
-            Platform(500, 150, 150, 20),
-            Platform(700, 250, 150, 20),
-            Platform(900, 200, 150, 20),
-            Platform(1100, 300, 150, 20),
-            Platform(1300, 250, 150, 20),
-            Platform(1500, 200, 150, 20),
-            Platform(1700, 300, 150, 20),
-            Platform(1900, 250, 150, 20),
-            Platform(2100, 350, 150, 20),
-            Platform(2300, 300, 150, 20),
-            Platform(2500, 400, 150, 20),
-            Platform(2800, 500, 150, 20),
-        ]
-        for platform in platforms:
+        self.scheduler.clear()  # Events of the last level or run, such as the player's reload
+        self.camera.reset(level.world_width)
+        self.place_player(*level.player_start)
+        self.background = self.load_background(level.background)
+        platforms = level.platforms
+        for i in range(0, len(platforms), 4):
+            platform = Platform(platforms[i], platforms[i + 1], platforms[i + 2], platforms[i + 3])
             self.platforms.add(platform)
-            self.all_sprites.add(platform)
-        enemies = [
-            Enemy(300, 160),
-            Enemy(500, 110),
-            Enemy(700, 210),
-            Enemy(900, 160),
-            Enemy(1100, 260),
-            Enemy(1300, 210),
-            Enemy(1500, 160),
-            Enemy(1700, 260),
-            Enemy(1900, 210),
-            Enemy(2100, 310),
-            Enemy(2300, 260),
-            Enemy(2500, 360),
-        ]
-        for enemy in enemies:
+        self.platform_index.rebuild(self.platforms)
+        self.static_layer.bake(self.platforms)
+        enemies = level.enemies
+        for i in range(0, len(enemies), 3):
+            enemy = Enemy(enemies[i], enemies[i + 1], self.assets, shoot_rate=enemies[i + 2])
             self.enemies.add(enemy)
-            self.all_sprites.add(enemy)
-        goal = Goal(2800, 450)
+        self.bullet_damage = level.bullet_damage
+        goal = Goal(*level.goal)
         self.goals.add(goal)
-        self.all_sprites.add(goal)
-        print(f"Goal created at x={goal.rect.x}, y={goal.rect.y}")
+        level_log.info("%s goal created at x=%d, y=%d", level.name, goal.rect.x, goal.rect.y)
+        self.checkpoint()
 
-    def reset_final_level(self):
-        self.all_sprites.empty()
-        self.platforms.empty()
-        self.enemies.empty()
-        self.bullets.empty()
-        self.enemy_bullets.empty()
-        self.goals.empty()
-        self.scroll_x = 0
+    def place_player(self, x, y):
         if self.player:
-            self.player.rect.x = 100
-            self.player.rect.y = 100
+            self.player.rect.x = x
+            self.player.rect.y = y
             self.player.velocity_y = 0
             self.player.health = self.player.max_health
-            self.player.shoot_rate = 5 if "faster_shooting" in self.upgrades else 10
-            self.player.speed = 7 if "faster_movement" in self.upgrades else PLAYER_SPEED
-            if "shield" in self.upgrades:
-                self.player.activate_shield()
-            self.all_sprites.add(self.player)
+            self.player.reloading = False
         else:
-            self.player = Player(100, 100, self)
-            self.player.shoot_rate = 5 if "faster_shooting" in self.upgrades else 10
-            self.player.speed = 7 if "faster_movement" in self.upgrades else PLAYER_SPEED
-            if "shield" in self.upgrades:
-                self.player.activate_shield()
-            self.all_sprites.add(self.player)
-        platforms = [
-            Platform(100, 200, 200, 20),
-            Platform(350, 180, 200, 20),
-            Platform(600, 220, 200, 20),
-            Platform(850, 200, 200, 20),
-            Platform(1100, 240, 200, 20),
-            Platform(1400, 220, 200, 20),
-            Platform(1700, 260, 200, 20),
-            Platform(2000, 240, 200, 20),
-            Platform(2300, 280, 200, 20),
-            Platform(2600, 300, 200, 20),
-            Platform(2900, 450, 200, 20),
-        ]
-        for platform in platforms:
-            self.platforms.add(platform)
-            self.all_sprites.add(platform)
-        enemies = [
-            Enemy(350, 140, shoot_rate=60),
-            Enemy(600, 180, shoot_rate=60),
-            Enemy(850, 160, shoot_rate=60),
-            Enemy(1100, 200, shoot_rate=60),
-            Enemy(1400, 180, shoot_rate=60),
-            Enemy(1700, 220, shoot_rate=60),
-            Enemy(2000, 200, shoot_rate=60),
-            Enemy(2300, 240, shoot_rate=60),
-        ]
-        for enemy in enemies:
-            self.enemies.add(enemy)
-            self.all_sprites.add(enemy)
-        goal = Goal(2900, 400)
-        self.goals.add(goal)
-        self.all_sprites.add(goal)
-        print(f"Final level goal created at x={goal.rect.x}, y={goal.rect.y}")
+            self.player = Player(x, y, self)
+        self.player.shoot_rate = 5 if "faster_shooting" in self.upgrades else 10
+        self.player.speed = 7 if "faster_movement" in self.upgrades else PLAYER_SPEED
+        if "shield" in self.upgrades:
+            self.player.activate_shield()
+        self.player.previous_pos = self.player.rect.topleft
+
+    def checkpoint(self):
+        # Respawns go back to the state saved here; load_level saves the start of the level
+        self.snapshot = LevelSnapshot(self)
+
+    def restore(self, snapshot):
+        self.projectiles.clear()
+        self.camera.reset(self.level.world_width, snapshot.camera_x)
+        self.enemies.restore(snapshot.enemies)
+        self.enemy_index.clear()
+        self.goals.add(snapshot.goals)
+        self.place_player(*snapshot.player_pos)
+
+    def load_background(self, name):
+        try:
+            return self.assets.image(name, (WIDTH, HEIGHT), alpha=False)
+        except pygame.error as e:
+            asset_log.warning("Couldn't load assets/%s, using fallback background. Error: %s", name, e)
+            background = pygame.Surface((WIDTH, HEIGHT))
+            background.fill(SKY_BLUE)
+            pygame.draw.rect(background, RED, (0, HEIGHT - 40, WIDTH, 40))
+            return background
+
+    def reset_level(self):
+        self.restore(self.snapshot)
+
+    def hit_enemy(self, enemy, damage):
+        enemy.health -= damage
+        if enemy.health <= 0:
+            self.enemies.remove(enemy)
+            self.score += 50
 
     def run(self):
         while True:
@@ -855,10 +2154,8 @@ class Game:
                 self.run_menu()
             elif self.state == "levels":
                 self.run_levels()
-            elif self.state == "playing":
+            elif self.state in ("playing", "final_level"):
                 self.run_game()
-            elif self.state == "final_level":
-                self.run_final_level()
             elif self.state == "game_over":
                 self.run_game_over()
             elif self.state == "win":
@@ -871,124 +2168,106 @@ class Game:
                 self.run_context()
 
     def run_menu(self):
-        if self.menu_music_loaded and not pygame.mixer.music.get_busy():
-            pygame.mixer.music.load(os.path.join("assets", "musicamenu.mp3"))
-            pygame.mixer.music.set_volume(0.5)
-            pygame.mixer.music.play(-1)
-        for event in pygame.event.get():
+        self.audio.play_music("menu")
+        events, full_redraw = self.static_events()
+        for event in events:
             if event.type == QUIT:
                 pygame.quit()
                 sys.exit()
             result = self.menu.update(event)
             if result:
                 if result == "Play":
-                    if self.menu_music_loaded:
-                        pygame.mixer.music.stop()
-                    self.state = "playing"
-                    self.score = 0
-                    self.lives = 3
-                    self.scroll_x = 0
-                    self.reset_game()
+                    self.audio.stop_music()
+                    self.start_run("level1")
                 elif result == "Levels":
                     self.state = "levels"
-                    self.level_select = LevelSelect(self.screen, self.font, self.small_font)
+                    self.level_select = LevelSelect(self.screen, self.font, self.small_font, self.assets,
+                                                    self.text_cache)
                 elif result == "Shop":
                     self.state = "shop"
-                    self.shop = Shop(self.screen, self.font, self.small_font, self.total_score, self.upgrades)
+                    self.shop = Shop(self.screen, self.font, self.small_font, self.total_score, self.upgrades,
+                                     self.assets, self.text_cache)
                 elif result == "Credits":
-                    if self.menu_music_loaded:
-                        pygame.mixer.music.stop()
+                    self.audio.stop_music()
                     self.state = "credits"
                 elif result == "Context":
-                    if self.menu_music_loaded:
-                        pygame.mixer.music.stop()
+                    self.audio.stop_music()
                     self.state = "context"
-                    self.context = Context(self.screen, self.small_font)
+                    self.context = Context(self.screen, self.small_font, self.text_cache)
                 elif result == "Quit":
-                    if self.menu_music_loaded:
-                        pygame.mixer.music.stop()
+                    self.audio.stop_music()
                     pygame.quit()
                     sys.exit()
-        self.menu.draw()
-        pygame.display.flip()
-        self.clock.tick(FPS)
+        if self.state == "menu":
+            self.present(self.menu.refresh(full_redraw))
 
     def run_levels(self):
-        for event in pygame.event.get():
+        events, full_redraw = self.static_events()
+        for event in events:
             if event.type == QUIT:
                 pygame.quit()
                 sys.exit()
             result = self.level_select.update(event)
             if result:
                 if result == "Level1":
-                    if self.menu_music_loaded:
-                        pygame.mixer.music.stop()
-                    self.state = "playing"
-                    self.score = 0
-                    self.lives = 3
-                    self.scroll_x = 0
-                    self.reset_game()
+                    self.audio.stop_music()
+                    self.start_run("level1")
                 elif result == "Level2":
-                    if self.menu_music_loaded:
-                        pygame.mixer.music.stop()
-                    self.state = "final_level"
-                    self.score = 0
-                    self.lives = 3
-                    self.scroll_x = 0
-                    if self.player is None:
-                        self.player = Player(100, 100, self)
-                        self.player.shoot_rate = 5 if "faster_shooting" in self.upgrades else 10
-                        self.player.speed = 7 if "faster_movement" in self.upgrades else PLAYER_SPEED
-                        if "shield" in self.upgrades:
-                            self.player.activate_shield()
-                        self.all_sprites.add(self.player)
-                    self.reset_final_level()
+                    self.audio.stop_music()
+                    self.start_run("level2")
                 elif result == "Back":
                     self.state = "menu"
-        self.level_select.draw()
-        pygame.display.flip()
-        self.clock.tick(FPS)
+        if self.state == "levels":
+            self.present(self.level_select.refresh(full_redraw))
 
     def run_context(self):
-        if self.context_music_loaded and not pygame.mixer.music.get_busy():
-            pygame.mixer.music.load(os.path.join("assets", "teclado.mp3"))
-            pygame.mixer.music.set_volume(0.5)
-            pygame.mixer.music.play(-1)
+        if self.drawn_state != "context":
+            # The menus sleep without ticking the clock; don't count that time as typing time
+            self.drawn_state = "context"
+            self.clock.tick()
+            dt = 0
+        else:
+            dt = self.clock.get_time()
+        self.audio.play_music("context")
         for event in pygame.event.get():
             if event.type == QUIT:
                 pygame.quit()
                 sys.exit()
             if event.type == KEYDOWN:
                 if event.key == K_RETURN:
-                    if self.context_music_loaded:
-                        pygame.mixer.music.stop()
+                    self.audio.stop_music()
                     self.state = "menu"
-                    print("ENTER pressed, returning to menu")
-        self.context.update()
+                    context_log.debug("ENTER pressed, returning to menu")
+        self.context.update(dt)
         self.context.draw()
         pygame.display.flip()
         self.clock.tick(FPS)
 
     def run_shop(self):
-        for event in pygame.event.get():
+        events, full_redraw = self.static_events()
+        for event in events:
             if event.type == QUIT:
                 pygame.quit()
                 sys.exit()
+            if event.type == MOUSEBUTTONDOWN:
+                full_redraw = True
             result = self.shop.update(event)
             if result == "menu":
                 self.state = "menu"
-        self.shop.draw()
-        pygame.display.flip()
-        self.clock.tick(FPS)
+        if self.state == "shop":
+            self.present(self.shop.refresh(full_redraw))
 
     def run_credits(self):
-        for event in pygame.event.get():
+        events, full_redraw = self.static_events()
+        for event in events:
             if event.type == QUIT:
                 pygame.quit()
                 sys.exit()
             if event.type == KEYDOWN:
                 if event.key == K_RETURN:
                     self.state = "menu"
+        if not full_redraw or self.state != "credits":
+            return
         if self.use_credits_image:
             self.screen.blit(self.credits_image, (0, 0))
         else:
@@ -1002,269 +2281,218 @@ class Game:
             pygame.draw.ellipse(self.screen, (200, 200, 200), (500, 80, 100, 50))
             pygame.draw.ellipse(self.screen, (200, 200, 200), (300, 120, 90, 45))
         pygame.display.flip()
-        self.clock.tick(FPS)
+
+    def static_events(self):
+        # Static screens sleep in event.wait until something happens instead of redrawing at FPS.
+        # Returns the events and whether the screen has to be drawn from scratch.
+        full_redraw = self.drawn_state != self.state
+        self.drawn_state = self.state
+        if full_redraw:
+            events = pygame.event.get()
+        else:
+            events = [pygame.event.wait(IDLE_WAIT_MS)] + pygame.event.get()
+        for event in events:
+            if event.type in (VIDEOEXPOSE, WINDOWEXPOSED):
+                full_redraw = True
+        return events, full_redraw
+
+    def present(self, dirty_rects):
+        if dirty_rects:
+            pygame.display.update(dirty_rects)
 
     def run_game(self):
-        if self.play_music_loaded and not pygame.mixer.music.get_busy():
-            pygame.mixer.music.load(os.path.join("assets", "musicaplay.mp3"))
-            pygame.mixer.music.set_volume(0.5)
-            pygame.mixer.music.play(-1)
-        for event in pygame.event.get():
-            if event.type == QUIT:
-                pygame.quit()
-                sys.exit()
-            if event.type == KEYDOWN:
-                if event.key == K_w:
-                    self.player.jump()
-                if event.key == K_ESCAPE:
-                    if self.play_music_loaded:
-                        pygame.mixer.music.stop()
-                    self.state = "menu"
-        keys = pygame.key.get_pressed()
-        dx, dy = 0, 0
-        if keys[K_a]:
-            dx -= 1
-        if keys[K_d]:
-            dx += 1
-        if keys[K_s]:
-            dy += 1
-        if keys[K_SPACE]:
-            self.player.shoot(self.bullets, self.all_sprites)
-        if dx > 0 and self.player.rect.x > WIDTH // 2 and self.scroll_x < WORLD_WIDTH - WIDTH:
-            self.scroll_x += self.player.speed
-            self.player.rect.x = WIDTH // 2
-            for sprite in self.all_sprites:
-                if sprite != self.player:
-                    sprite.rect.x -= self.player.speed
+        # The simulation advances in fixed ticks of TICK_MS, as many per frame as real time
+        # requires, so slow or fast rendering no longer changes the speed of the game
+        if self.drawn_state != "gameplay":
+            # Coming from another screen: start the simulation clock afresh
+            self.drawn_state = "gameplay"
+            self.clock.tick()
+            self.accumulator = TICK_MS
         else:
-            self.player.move(dx, dy)
-        if self.scroll_x < 0:
-            self.scroll_x = 0
-            for sprite in self.all_sprites:
-                if sprite != self.player:
-                    sprite.rect.x -= self.scroll_x
-            self.scroll_x = 0
-        elif self.scroll_x > WORLD_WIDTH - WIDTH:
-            self.scroll_x = WORLD_WIDTH - WIDTH
-            for sprite in self.all_sprites:
-                if sprite != self.player:
-                    sprite.rect.x -= self.scroll_x
-            self.scroll_x = WORLD_WIDTH - WIDTH
-        self.player.update(self.platforms)
-        for enemy in self.enemies:
-            enemy.update(self.platforms, self.player, self.enemy_bullets, self.all_sprites)
-        self.bullets.update()
-        self.enemy_bullets.update()
-        for sprite in self.enemies.sprites() + self.bullets.sprites() + self.enemy_bullets.sprites():
-            if sprite.rect.right < 0:
-                sprite.kill()
-        if self.player.rect.bottom >= GROUND_LEVEL or pygame.sprite.spritecollide(self.player, self.enemies, False):
-            if self.player.take_damage():
-                self.lives -= 1
-                self.player.health = self.player.max_health
-                self.player.rect.x = 100
-                self.player.rect.y = 100
-                self.player.velocity_y = 0
-                self.scroll_x = 0
-                for sprite in self.all_sprites:
-                    if sprite != self.player:
-                        sprite.rect.x += self.scroll_x
-                self.reset_game()
-                if self.lives <= 0:
-                    if self.play_music_loaded:
-                        pygame.mixer.music.stop()
-                    self.total_score += self.score
-                    self.state = "game_over"
-        enemy_bullet_hits = pygame.sprite.spritecollide(self.player, self.enemy_bullets, True)
-        for hit in enemy_bullet_hits:
-            if self.player.take_damage():
-                self.player.health -= 10
-                if self.player.health <= 0:
-                    self.lives -= 1
-                    self.player.health = self.player.max_health
-                    self.player.rect.x = 100
-                    self.player.rect.y = 100
-                    self.player.velocity_y = 0
-                    self.scroll_x = 0
-                    for sprite in self.all_sprites:
-                        if sprite != self.player:
-                            sprite.rect.x += self.scroll_x
-                    self.reset_game()
-                    if self.lives <= 0:
-                        if self.play_music_loaded:
-                            pygame.mixer.music.stop()
-                        self.total_score += self.score
-                        self.state = "game_over"
-        for bullet in self.bullets:
-            hits = pygame.sprite.spritecollide(bullet, self.enemies, False)
-            for enemy in hits:
-                enemy.health -= 20
-                bullet.kill()
-                if enemy.health <= 0:
-                    enemy.kill()
-                    self.score += 50
-        print(f"Goals active: {len(self.goals.sprites())}")
-        if self.goals:
-            print(
-                f"Player: x={self.player.rect.x}, y={self.player.rect.y}, Goal: x={self.goals.sprites()[0].rect.x}, y={self.goals.sprites()[0].rect.y}")
-        if self.goals and pygame.sprite.spritecollide(self.player, self.goals, True):
-            print("Goal collided! Transitioning to final_level")
-            self.state = "final_level"
-            self.reset_final_level()
-        self.screen.blit(self.background, (0, 0))
-        self.all_sprites.draw(self.screen)
-        for enemy in self.enemies:
-            enemy.draw_health_bar(self.screen)
-        self.player.draw_health_bar(self.screen)
-        score_text = self.small_font.render(f"Score: {self.score}", True, BLACK)
-        self.screen.blit(score_text, (10, 10))
-        for i in range(self.lives):
-            self.screen.blit(self.heart_image, (10 + i * 42, 50))
-        pygame.display.flip()
-        self.clock.tick(FPS)
+            self.accumulator += min(self.clock.get_time(), MAX_FRAME_MS)
+        if self.state == "final_level":
+            level_log.debug("Entered final_level state")
+        self.audio.play_music("playing")
+        profiler = self.profiler
+        profiler.begin_frame()
+        controls = profiler.measure("input", self.read_controls)
+        # A jump pressed during a frame that runs no tick is kept for the next one
+        controls.jump = controls.jump or self.jump_queued
+        while self.accumulator >= TICK_MS and self.state in ("playing", "final_level"):
+            if self.replay and self.replay.finished:
+                break
+            self.step_level(controls)
+            controls.jump = False
+            self.accumulator -= TICK_MS
+        self.jump_queued = controls.jump
+        if self.replay and (self.replay.finished or self.state not in ("playing", "final_level")):
+            self.finish_replay()
+            if self.state in ("playing", "final_level"):
+                # The recorded input ran out in the middle of the level
+                self.audio.stop_music()
+                self.state = "menu"
+        alpha = self.accumulator / TICK_MS if self.interpolate else 1.0
+        profiler.measure("render", self.draw_level, alpha)
+        profiler.draw(self.screen)
+        profiler.measure("display", pygame.display.flip)
+        profiler.measure("wait", self.clock.tick, MAX_FPS if self.interpolate else FPS)
+        profiler.end_frame()
 
-    def run_final_level(self):
-        print("Entered final_level state")
-        if self.play_music_loaded and not pygame.mixer.music.get_busy():
-            pygame.mixer.music.load(os.path.join("assets", "musicaplay.mp3"))
-            pygame.mixer.music.set_volume(0.5)
-            pygame.mixer.music.play(-1)
+    def read_controls(self):
+        controls = Controls()
         for event in pygame.event.get():
             if event.type == QUIT:
                 pygame.quit()
                 sys.exit()
             if event.type == KEYDOWN:
                 if event.key == K_w:
-                    self.player.jump()
+                    controls.jump = True
                 if event.key == K_ESCAPE:
-                    if self.play_music_loaded:
-                        pygame.mixer.music.stop()
+                    self.audio.stop_music()
                     self.state = "menu"
+                if event.key == K_F3:
+                    self.profiler.toggle_requested = True
+                if event.key == K_F4 and self.profiler.enabled:
+                    self.profiler.dump_csv(f"profile_{time.strftime('%Y%m%d_%H%M%S')}.csv")
         keys = pygame.key.get_pressed()
-        dx, dy = 0, 0
         if keys[K_a]:
-            dx -= 1
+            controls.dx -= 1
         if keys[K_d]:
-            dx += 1
+            controls.dx += 1
         if keys[K_s]:
-            dy += 1
-        if keys[K_SPACE]:
-            self.player.shoot(self.bullets, self.all_sprites)
-        if dx > 0 and self.player.rect.x > WIDTH // 2 and self.scroll_x < WORLD_WIDTH - WIDTH:
-            self.scroll_x += self.player.speed
-            self.player.rect.x = WIDTH // 2
-            for sprite in self.all_sprites:
-                if sprite != self.player:
-                    sprite.rect.x -= self.player.speed
-        else:
-            self.player.move(dx, dy)
-        if self.scroll_x < 0:
-            self.scroll_x = 0
-            for sprite in self.all_sprites:
-                if sprite != self.player:
-                    sprite.rect.x -= self.scroll_x
-            self.scroll_x = 0
-        elif self.scroll_x > WORLD_WIDTH - WIDTH:
-            self.scroll_x = WORLD_WIDTH - WIDTH
-            for sprite in self.all_sprites:
-                if sprite != self.player:
-                    sprite.rect.x -= self.scroll_x
-            self.scroll_x = WORLD_WIDTH - WIDTH
-        self.player.update(self.platforms)
-        for enemy in self.enemies:
-            enemy.update(self.platforms, self.player, self.enemy_bullets, self.all_sprites)
-        self.bullets.update()
-        self.enemy_bullets.update()
-        for sprite in self.enemies.sprites() + self.bullets.sprites() + self.enemy_bullets.sprites():
-            if sprite.rect.right < 0:
-                sprite.kill()
-        if self.player.rect.bottom >= GROUND_LEVEL or pygame.sprite.spritecollide(self.player, self.enemies, False):
+            controls.dy += 1
+        controls.shoot = keys[K_SPACE]
+        return controls
+
+    def step_level(self, controls):
+        # One simulation tick of the current level; input and drawing are handled by the caller
+        profiler = self.profiler
+        if self.replay:
+            controls = self.replay.step(controls)
+        self.camera.previous_x = self.camera.x
+        self.player.previous_pos = self.player.rect.topleft
+        profiler.measure("input", self.apply_controls, controls)
+        profiler.measure("physics", self.update_physics)
+        profiler.measure("ai", self.update_enemies)
+        profiler.measure("collisions", self.resolve_collisions)
+
+    def apply_controls(self, controls):
+        if controls.jump:
+            self.player.jump()
+        if controls.shoot:
+            self.player.shoot(self.projectiles)
+        self.player.move(controls.dx, controls.dy)
+
+    def update_physics(self):
+        self.player.update(self.platform_index)
+        self.camera.follow(self.player.rect)
+
+    def update_enemies(self):
+        # Sleeping enemies are frozen until the camera comes within ACTIVE_MARGIN of them. Only awake
+        # ones can reach the screen, so only they go into the collision index. Projectiles move
+        # after the enemies have fired, so a shot travels on the tick it is spawned.
+        enemies = self.enemies
+        enemies.update(self.camera.active_area, self.platform_index)
+        self.scheduler.advance()
+        enemies.shoot(self.player, self.projectiles)
+        self.projectiles.update(self.camera.view)
+        enemies.cull(self.camera.x)
+        self.enemy_index.rebuild(enemies.awake)
+
+    def resolve_collisions(self):
+        if self.player.rect.bottom >= GROUND_LEVEL or self.enemy_index.query(self.player.rect):
             if self.player.take_damage():
-                self.lives -= 1
-                self.player.health = self.player.max_health
-                self.player.rect.x = 100
-                self.player.rect.y = 100
-                self.player.velocity_y = 0
-                self.scroll_x = 0
-                for sprite in self.all_sprites:
-                    if sprite != self.player:
-                        sprite.rect.x += self.scroll_x
-                self.reset_final_level()
-                if self.lives <= 0:
-                    if self.play_music_loaded:
-                        pygame.mixer.music.stop()
-                    self.total_score += self.score
-                    self.state = "game_over"
-        enemy_bullet_hits = pygame.sprite.spritecollide(self.player, self.enemy_bullets, True)
-        for hit in enemy_bullet_hits:
+                self.lose_life()
+        enemy_bullet_hits = self.projectiles.collide_rect(ProjectileSystem.ENEMY, self.player.rect)
+        for _ in range(enemy_bullet_hits):
             if self.player.take_damage():
                 self.player.health -= 10
                 if self.player.health <= 0:
-                    self.lives -= 1
-                    self.player.health = self.player.max_health
-                    self.player.rect.x = 100
-                    self.player.rect.y = 100
-                    self.player.velocity_y = 0
-                    self.scroll_x = 0
-                    for sprite in self.all_sprites:
-                        if sprite != self.player:
-                            sprite.rect.x += self.scroll_x
-                    self.reset_final_level()
-                    if self.lives <= 0:
-                        if self.play_music_loaded:
-                            pygame.mixer.music.stop()
-                        self.total_score += self.score
-                        self.state = "game_over"
-        for bullet in self.bullets:
-            hits = pygame.sprite.spritecollide(bullet, self.enemies, False)
-            for enemy in hits:
-                enemy.health -= 10  # Level 2: 3 shots to kill (30 health / 10 damage = 3)
-                bullet.kill()
-                if enemy.health <= 0:
-                    enemy.kill()
-                    self.score += 50
-        print(f"Goals active: {len(self.goals.sprites())}")
-        if self.goals:
-            print(
-                f"Player: x={self.player.rect.x}, y={self.player.rect.y}, Goal: x={self.goals.sprites()[0].rect.x}, y={self.goals.sprites()[0].rect.y}")
+                    self.lose_life()
+        self.projectiles.collide_index(ProjectileSystem.PLAYER, self.enemy_index,
+                                       lambda enemy: self.hit_enemy(enemy, self.bullet_damage))
+        # Per-tick diagnostics: the check keeps the argument building off the hot path when disabled
+        if level_log.isEnabledFor(logging.DEBUG):
+            level_log.debug("Goals active: %d", len(self.goals))
+            if self.goals:
+                goal = self.goals.sprites()[0]
+                level_log.debug("Player: x=%d, y=%d, Goal: x=%d, y=%d",
+                                self.player.rect.x, self.player.rect.y, goal.rect.x, goal.rect.y)
         if self.goals and pygame.sprite.spritecollide(self.player, self.goals, True):
-            print("Goal collided! You win!")
-            if self.play_music_loaded:
-                pygame.mixer.music.stop()
+            if self.level.next_level:
+                level_log.info("Goal collided! Transitioning to %s", self.level.next_level)
+                self.state = "final_level"
+                self.load_level(self.level.next_level)
+            else:
+                level_log.info("Goal collided! You win!")
+                self.audio.stop_music()
+                self.total_score += self.score
+                self.state = "win"
+
+    def lose_life(self):
+        # reset_level puts the player back where the snapshot has it, with full health
+        self.lives -= 1
+        self.reset_level()
+        if self.lives <= 0:
+            self.audio.stop_music()
             self.total_score += self.score
-            self.state = "win"
-        self.screen.blit(self.background, (0, 0))
-        self.all_sprites.draw(self.screen)
-        for enemy in self.enemies:
-            enemy.draw_health_bar(self.screen)
-        self.player.draw_health_bar(self.screen)
-        score_text = self.small_font.render(f"Score: {self.score}", True, BLACK)
-        self.screen.blit(score_text, (10, 10))
+            self.state = "game_over"
+
+    def draw_level(self, alpha=1.0):
+        # alpha is how far the frame lies between the previous tick and the current one; the
+        # camera and the player are drawn that far along, everything else at the current tick.
+        # The whole frame goes through the render queue, back to front, and reaches the screen in
+        # a single blits() call.
+        queue = self.render_queue
+        bars = self.health_bars
+        queue.add(self.background, (0, 0))
+        camera = self.camera
+        camera.blend(alpha)
+        camera_x = camera.offset
+        view = camera.view
+        self.static_layer.draw(queue, camera_x)
+        camera.draw(queue, self.goals)
+        camera.draw(queue, self.enemies.awake)
+        player = self.player
+        previous_x, previous_y = player.previous_pos
+        shift_x = round((previous_x - player.rect.x) * (1 - alpha))
+        shift_y = round((previous_y - player.rect.y) * (1 - alpha))
+        player_x = player.rect.x + shift_x - camera_x
+        player_y = player.rect.y + shift_y
+        queue.add(player.image, (player_x, player_y))
+        self.projectiles.draw(queue, camera_x)
+        for enemy in self.enemies.awake:
+            if view.colliderect(enemy.rect):
+                enemy.draw_health_bar(queue, bars, camera_x)
+        player.draw_health_bar(queue, bars, player_x, player_y)
+        queue.add(self.text_cache.render(self.small_font, f"Score: {self.score}", True, BLACK), (10, 10))
         for i in range(self.lives):
-            self.screen.blit(self.heart_image, (10 + i * 42, 50))
-        pygame.display.flip()
-        self.clock.tick(FPS)
+            queue.add(self.heart_image, (10 + i * 42, 50))
+        queue.flush(self.screen)
 
     def run_win(self):
-        for event in pygame.event.get():
+        events, full_redraw = self.static_events()
+        for event in events:
             if event.type == QUIT:
                 pygame.quit()
                 sys.exit()
             if event.type == KEYDOWN:
                 if event.key == K_RETURN:
                     self.state = "menu"
+        if not full_redraw or self.state != "win":
+            return
         if self.use_win_image:
             self.screen.blit(self.win_image, (0, 0))
         else:
             self.screen.fill((0, 150, 0))
-            win_text = self.font.render("WIN!", True, WHITE)
-            score_text = self.font.render(f"Final Score: {self.score}", True, WHITE)
+            win_text = self.text_cache.render(self.font, "WIN!", True, WHITE)
+            score_text = self.text_cache.render(self.font, f"Final Score: {self.score}", True, WHITE)
             win_text_rect = win_text.get_rect(center=(WIDTH // 2, 200))
             score_text_rect = score_text.get_rect(center=(WIDTH // 2, 300))
             self.screen.blit(win_text, win_text_rect)
             self.screen.blit(score_text, score_text_rect)
-        instruction = self.small_font.render("Press ENTER to return to menu", True, WHITE)
-        instruction_shadow = self.small_font.render("Press ENTER to return to menu", True, BLACK)
+        instruction = self.text_cache.render(self.small_font, "Press ENTER to return to menu", True, WHITE)
+        instruction_shadow = self.text_cache.render(self.small_font, "Press ENTER to return to menu", True, BLACK)
         instruction_rect = instruction.get_rect(center=(WIDTH // 2, HEIGHT - 30))
         shadow_rect = instruction_rect.copy()
         shadow_rect.x += 2
@@ -1272,23 +2500,25 @@ class Game:
         self.screen.blit(instruction_shadow, shadow_rect)
         self.screen.blit(instruction, instruction_rect)
         pygame.display.flip()
-        self.clock.tick(FPS)
 
     def run_game_over(self):
-        for event in pygame.event.get():
+        events, full_redraw = self.static_events()
+        for event in events:
             if event.type == QUIT:
                 pygame.quit()
                 sys.exit()
             if event.type == KEYDOWN:
                 if event.key == K_RETURN:
                     self.state = "menu"
+        if not full_redraw or self.state != "game_over":
+            return
         if self.use_gameover_image:
             self.screen.blit(self.gameover_image, (0, 0))
         else:
             self.screen.fill(BLACK)
-            game_over = self.font.render("Game Over!", True, WHITE)
-            score_text = self.font.render(f"Final Score: {self.score}", True, WHITE)
-            instruction = self.font.render("Press ENTER to return to menu", True, WHITE)
+            game_over = self.text_cache.render(self.font, "Game Over!", True, WHITE)
+            score_text = self.text_cache.render(self.font, f"Final Score: {self.score}", True, WHITE)
+            instruction = self.text_cache.render(self.font, "Press ENTER to return to menu", True, WHITE)
             game_over_rect = game_over.get_rect(center=(WIDTH // 2, 200))
             score_text_rect = score_text.get_rect(center=(WIDTH // 2, 300))
             instruction_rect = instruction.get_rect(center=(WIDTH // 2, 450))
@@ -1296,9 +2526,142 @@ class Game:
             self.screen.blit(score_text, score_text_rect)
             self.screen.blit(instruction, instruction_rect)
         pygame.display.flip()
-        self.clock.tick(FPS)
 
 
-if __name__ == "__main__":
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    # Hands records to the writer thread without ever blocking the frame: when the bounded
+    # queue is full the record is dropped and counted instead
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(spec="", queue_size=1024):
+    # spec is a level for every category ("DEBUG") or per category ("level=DEBUG,context=INFO").
+    # Categories not mentioned only report warnings. An unknown level raises ValueError before
+    # anything is changed.
+    levels = []
+    for item in filter(None, spec.split(",")):
+        category, _, level = item.rpartition("=")
+        if not isinstance(logging.getLevelName(level.upper()), int):
+            raise ValueError(f"unknown log level {level!r} in {item!r}, use DEBUG, INFO, WARNING or ERROR")
+        levels.append((category, level.upper()))
+    root = logging.getLogger("shuriken")
+    root.setLevel(logging.WARNING)
+    # Replay results and profiles were asked for on the command line, so they show unless turned down
+    replay_log.setLevel(logging.INFO)
+    profile_log.setLevel(logging.INFO)
+    root.propagate = False
+    for category, level in levels:
+        logger = logging.getLogger(f"shuriken.{category}") if category else root
+        logger.setLevel(level)
+    log_queue = queue.Queue(queue_size)
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(logging.Formatter("%(levelname)s [%(name)s] %(message)s"))
+    listener = logging.handlers.QueueListener(log_queue, output)
+    listener.start()
+    atexit.register(listener.stop)
+    handler = DroppingQueueHandler(log_queue)
+    root.handlers = [handler]
+    return handler
+
+
+def scripted_controls(tick):
+    # Default headless script: run right while firing, jumping every 45 ticks
+    return Controls(dx=1, jump=tick % 45 == 0, shoot=True)
+
+
+def run_headless(level=1, ticks=600, script=scripted_controls, render=False, profile=None, replay=None,
+                 record=None):
+    # Builds a level without a real window or audio device and advances it as fast as possible.
+    # Returns the duration of every tick in nanoseconds; with `profile` the per-section history
+    # is also written to that CSV file. `replay` plays a recorded run back instead of the script and
+    # `record` saves the scripted run; either way the run ends with the level instead of restarting.
+    pygame.display.quit()
+    pygame.mixer.quit()
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    os.environ["SDL_AUDIODRIVER"] = "dummy"
+    pygame.display.init()
+    pygame.mixer.init()
+    game = Game(headless=True)
+    if profile:
+        game.profiler = FrameProfiler(["input", "physics", "ai", "collisions", "render"], history=ticks)
+        game.profiler.enabled = True
+    game.record_path = record
+    if replay:
+        ticks = len(replay.inputs)
+        game.start_run(replay.level, replay)
+    timings = []
+    for tick in range(ticks):
+        # Start over on game over or win so that exactly `ticks` ticks are measured
+        if game.state not in ("playing", "final_level"):
+            if game.replay:
+                break
+            game.start_run(f"level{level}")
+        start = time.perf_counter_ns()
+        game.profiler.begin_frame()
+        game.step_level(script(tick))
+        if render:
+            game.profiler.measure("render", game.draw_level)
+        game.profiler.end_frame()
+        timings.append(time.perf_counter_ns() - start)
+    if game.replay:
+        game.finish_replay()
+    if profile:
+        game.profiler.dump_csv(profile)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shuriken Sundown")
+    parser.add_argument("--headless", action="store_true", help="simulate without a window and report timings")
+    parser.add_argument("--level", type=int, default=1, help="number of the levels/levelN.json to simulate")
+    parser.add_argument("--ticks", type=int, default=600)
+    parser.add_argument("--render", action="store_true", help="also draw every tick to the off-screen surface")
+    parser.add_argument("--profile", metavar="CSV", help="write per-section timings of the headless run")
+    parser.add_argument("--record", metavar="FILE",
+                        help="record the first run started to FILE, later ones of the session to FILE-2, FILE-3...")
+    parser.add_argument("--replay", metavar="FILE", help="play a recorded run back, headless or in the window")
+    parser.add_argument("--interpolate", action="store_true",
+                        help=f"render up to {MAX_FPS} FPS, drawing between simulation ticks")
+    parser.add_argument("--log", default=os.environ.get("SHURIKEN_LOG", ""),
+                        help='log levels, e.g. "DEBUG" or "level=DEBUG,context=INFO"')
+    args = parser.parse_args()
+    try:
+        setup_logging(args.log)
+    except ValueError as e:
+        parser.error(str(e))
+    try:
+        replay = Replay.load(args.replay) if args.replay else None
+    except (OSError, ValueError, struct.error) as e:
+        parser.error(str(e))
+    levels = LevelLibrary().keys()
+    numbers = sorted(int(key[len("level"):]) for key in levels
+                     if key.startswith("level") and key[len("level"):].isdigit())
+    if f"level{args.level}" not in levels:
+        parser.error(f"there is no level {args.level}, choose from {', '.join(map(str, numbers))}")
+    if replay and replay.level not in levels:
+        parser.error(f"{args.replay} plays levels/{replay.level}.json, which doesn't exist")
+    if args.headless:
+        timings = run_headless(args.level, args.ticks, render=args.render, profile=args.profile, replay=replay,
+                               record=args.record)
+        total = sum(timings) / 1e9
+        print(f"{len(timings)} ticks in {total:.3f} s ({len(timings) / total:.0f} ticks/s), "
+              f"worst tick {max(timings) / 1e6:.2f} ms")
+        return
     game = Game()
+    game.interpolate = args.interpolate
+    game.record_path = args.record
+    if replay:
+        game.start_run(replay.level, replay)
     game.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import pygame
+
+from codijoc import ATLAS_ANIMATIONS, ATLAS_IMAGES, ATLAS_INDEX, AssetCache
+
+# Offline asset build. Folds copies of asset files kept in subfolders of assets/ back into assets/,
+# then renders every sprite variant the game asks for (scaled, cropped and flipped exactly as
+# AssetCache does it) and packs them into assets/build/atlas.png with an index of where each one is.
+# The index records the content hash of the atlas and the size and modification time of every
+# source file, so the game can tell when a sprite changed after the build and load that one from
+# its file instead. Rerun it after changing any sprite.
+#
+#   python tools/build_assets.py            report duplicates and build the atlas
+#   python tools/build_assets.py --prune    also delete duplicates and move files only found in a copy
+
+ATLAS_WIDTH = 256
+
+
+def digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def dedupe(prune):
+    build = os.path.dirname(ATLAS_INDEX)
+    saved = 0
+    for directory, subdirectories, files in os.walk("assets"):
+        subdirectories[:] = [name for name in subdirectories if os.path.join(directory, name) != build]
+        if directory == "assets":
+            continue
+        for name in sorted(files):
+            path = os.path.join(directory, name)
+            target = os.path.join("assets", name)
+            if not os.path.exists(target):
+                print(f"{path}: only copy, {'moved to' if prune else 'belongs in'} {target}")
+                if prune:
+                    shutil.move(path, target)
+            elif digest(path) == digest(target):
+                saved += os.path.getsize(path)
+                if prune:
+                    os.remove(path)
+            else:
+                print(f"{path}: differs from {target}, kept")
+    if prune:
+        for directory, subdirectories, files in os.walk("assets", topdown=False):
+            if directory not in ("assets", build) and not os.listdir(directory):
+                os.rmdir(directory)
+    print(f"Duplicates: {saved / 1024:.0f} KB{' removed' if prune else ''}")
+
+
+def source(name):
+    stat = os.stat(os.path.join("assets", name))
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def render():
+    # The same calls the game makes, on a cache without an atlas, so every variant comes out of the
+    # runtime code path pixel for pixel
+    assets = AssetCache()
+    for name, size in ATLAS_IMAGES:
+        assets.image(name, size)
+    for names, size in ATLAS_ANIMATIONS:
+        assets.animation(names, size)
+    sprites = [(key, surface) for key, surface in assets.surfaces.items()
+               if isinstance(surface, pygame.Surface) and key[1] and key[2]]
+    names = {name for name, size in ATLAS_IMAGES}
+    bounds = {}
+    for frames, size in ATLAS_ANIMATIONS:
+        names.update(frames)
+        bounds.update((name, tuple(assets.bounds(name))) for name in frames)
+    return sprites, sorted(names), bounds
+
+
+def pack(sprites):
+    # Shelves, tallest sprites first; the atlas is never scaled, so the sprites need no padding
+    placed = []
+    x = y = shelf = 0
+    for key, surface in sorted(sprites, key=lambda sprite: (-sprite[1].get_height(), sprite[0][0])):
+        width, height = surface.get_size()
+        if x + width > ATLAS_WIDTH:
+            x, y, shelf = 0, y + shelf, 0
+        placed.append((key, surface, pygame.Rect(x, y, width, height)))
+        x += width
+        shelf = max(shelf, height)
+    atlas = pygame.Surface((ATLAS_WIDTH, y + shelf), pygame.SRCALPHA)
+    atlas.fill((0, 0, 0, 0))
+    for key, surface, rect in placed:
+        # Adding onto transparent black copies the pixels, alpha included, instead of blending them
+        atlas.blit(surface, rect, special_flags=pygame.BLEND_RGBA_ADD)
+    return atlas, placed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the sprite atlas")
+    parser.add_argument("--prune", action="store_true", help="delete duplicate asset files")
+    args = parser.parse_args()
+
+    dedupe(args.prune)
+    pygame.display.set_mode((1, 1))
+    sprites, names, bounds = render()
+    atlas, placed = pack(sprites)
+    directory = os.path.dirname(ATLAS_INDEX)
+    os.makedirs(directory, exist_ok=True)
+    atlas_path = os.path.join(directory, "atlas.png")
+    pygame.image.save(atlas, atlas_path)
+    index = {
+        "atlas": "atlas.png",
+        "sha256": digest(atlas_path),
+        "sources": {name: source(name) for name in names},
+        "bounds": bounds,
+        "sprites": [{"name": key[0], "size": key[1], "flip_x": key[3], "crop": key[4], "rect": tuple(rect)}
+                    for key, surface, rect in placed],
+    }
+    with open(ATLAS_INDEX, "w") as f:
+        json.dump(index, f, indent=2)
+    print(f"Packed {len(placed)} sprites from {len(names)} files into {atlas_path} "
+          f"({atlas.get_width()}x{atlas.get_height()}, {os.path.getsize(atlas_path)} bytes)")
+
+
+if __name__ == "__main__":
+    main()